@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+import tracemalloc
+
+import index
+
+# Benchmarks do mapeador sobre uma árvore sintética determinística.
+# Uso:  python benchmark.py --files 10000 --out bench.json [--compare antes.json]
+
+FIXED_MTIME = 1577836800  # 2020-01-01: arquivos "velhos", fora da janela racy dos caches
+EXTENSIONS = (".py", ".js", ".ts", ".php", ".md", ".json", ".css", ".html", ".txt")
+NOISE_DIRS = ("node_modules", ".git", "__pycache__", "dist", "venv")
+WORDS = ("core", "utils", "api", "models", "views", "services", "lib", "tests",
+         "components", "assets", "config", "scripts", "handlers", "db", "ui")
+
+
+def generate_tree(root, files=1000, seed=1, fanout=8, depth=5, noise=0.3, file_bytes=400):
+    # gera sempre a mesma árvore para os mesmos parâmetros:
+    # "files" arquivos de código + uma fração "noise" de lixo ignorado
+    # (node_modules, .git, __pycache__...) e um .gitignore aninhado
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    dirs = [root]
+    while len(dirs) < max(1, files // fanout):
+        parent = rng.choice(dirs)
+        if parent[len(root):].count(os.sep) >= depth:
+            continue
+        name = f"{rng.choice(WORDS)}_{len(dirs)}"
+        path = os.path.join(parent, name)
+        os.makedirs(path, exist_ok=True)
+        dirs.append(path)
+
+    line = "x = 'lorem ipsum dolor sit amet'  # " + "-" * 20 + "\n"
+    body = (line * (file_bytes // len(line) + 1))[:file_bytes]
+    for i in range(files):
+        folder = dirs[i % len(dirs)] if i < len(dirs) else rng.choice(dirs)
+        ext = rng.choice(EXTENSIONS)
+        with open(os.path.join(folder, f"file_{i}{ext}"), "w", encoding="utf-8") as f:
+            f.write(body)
+
+    # ruído: pastas que o never_select.json/.gitignore descartam
+    noise_files = int(files * noise)
+    made = 0
+    while made < noise_files:
+        folder = os.path.join(rng.choice(dirs), rng.choice(NOISE_DIRS), f"pkg_{made}")
+        os.makedirs(folder, exist_ok=True)
+        for j in range(min(20, noise_files - made)):
+            with open(os.path.join(folder, f"mod_{j}.js"), "w", encoding="utf-8") as f:
+                f.write("module.exports = {};\n")
+        made += 20
+    for i, folder in enumerate(dirs[1::max(1, len(dirs) // 10)]):
+        with open(os.path.join(folder, ".gitignore"), "w", encoding="utf-8") as f:
+            f.write("*.log\nbuild/\n")
+        with open(os.path.join(folder, f"debug_{i}.log"), "w", encoding="utf-8") as f:
+            f.write("log\n")
+
+    # mtimes fixos: o cache do scan e do export funcionam igual em toda execução
+    for current, subdirs, names in os.walk(root, topdown=False):
+        for name in names:
+            os.utime(os.path.join(current, name), (FIXED_MTIME, FIXED_MTIME))
+        os.utime(current, (FIXED_MTIME, FIXED_MTIME))
+    return root
+
+
+def measure(fn, repeat=3, setup=None):
+    # mediana de "repeat" execuções; setup roda antes de cada uma, fora do tempo
+    runs, result = [], None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - start)
+    return {"seconds": statistics.median(runs), "runs": runs}, result
+
+
+def measure_memory(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def bench_scan(root, repeat, results):
+    index.SCAN_CACHE_ENABLED = False
+    stats, structure = measure(lambda: index.get_directory_structure(root, workers=1), repeat)
+    results["scan_cold"] = stats
+    results["scan_cold_parallel"], _ = measure(
+        lambda: index.get_directory_structure(root, workers=index.SCAN_NETWORK_WORKERS), repeat)
+    results["scan_cold_sizes"], _ = measure(
+        lambda: index.get_directory_structure(root, workers=1, sizes={}), repeat)
+    index.SCAN_CACHE_ENABLED = True
+    index.get_directory_structure(root)  # aquece o scan_cache.db
+    results["scan_cached"], _ = measure(lambda: index.get_directory_structure(root), repeat)
+    # a janela sempre pede os tamanhos (rodapé): o cache tem que valer nesse caminho também
+    results["scan_cached_sizes"], _ = measure(lambda: index.get_directory_structure(root, sizes={}), repeat)
+    return structure
+
+
+def bench_ignore(root, repeat, results):
+    # todos os caminhos crus da árvore, inclusive os que serão ignorados
+    paths = []
+    for current, subdirs, names in os.walk(root):
+        paths.extend(os.path.join(current, n) for n in subdirs + names)
+    stats, ignored = measure(lambda: sum(1 for p in paths if index.should_ignore(p, root)), repeat)
+    stats.update(calls=len(paths), ignored=ignored,
+                 per_call_us=stats["seconds"] / max(1, len(paths)) * 1e6)
+    results["should_ignore"] = stats
+
+
+def bench_render(root, structure, repeat, results):
+    stats, text = measure(lambda: index.render_tree(structure, root), repeat)
+    stats["lines"] = text.count("\n") + 1
+    results["render_tree"] = stats
+    # mesma árvore com a contagem por pasta (passada extra do tree_totals)
+    results["render_tree_totals"], _ = measure(
+        lambda: index.render_tree(structure, root, totals=index.tree_totals(structure, root)), repeat)
+
+
+def _batches(structure, root):
+    # os mesmos lotes que o ScanWorker entrega, a partir da estrutura pronta
+    stack = [(root, structure)]
+    while stack:
+        folder, node = stack.pop()
+        yield folder, [(p, sub is not None) for p, sub in node.items()]
+        stack.extend((p, sub) for p, sub in node.items() if sub is not None)
+
+
+def bench_build(root, structure, repeat, results):
+    batches = list(_batches(structure, root))
+
+    def build_trie():
+        trie = index.SelectionTrie(root)
+        for folder, entries in batches:
+            for full, is_dir in entries:
+                trie.add(folder, full, is_dir)
+        trie.select_all()
+        return trie
+
+    stats, _ = measure(build_trie, repeat)
+    stats["peak_bytes"], _ = measure_memory(build_trie)
+    results["selection_build"] = stats
+
+    # o Treeview precisa de display; sem ele (CI, servidor) fica só o modelo
+    try:
+        import tkinter as tk
+        window = tk.Tk()
+        window.withdraw()
+    except Exception as e:
+        results["checktree_build"] = {"skipped": f"sem display: {e}"}
+        return
+
+    def build_view():
+        view = index.CheckTree(window, root)
+        for folder, entries in batches:
+            view.add_batch(folder, entries)
+        view.select_all()
+        window.update_idletasks()
+        widgets = len(view.tree.get_children(""))
+        view.frame.destroy()
+        return widgets
+
+    try:
+        stats, widgets = measure(build_view, repeat)
+        stats["peak_bytes"], _ = measure_memory(build_view)
+        stats["top_level_items"] = widgets
+        results["checktree_build"] = stats
+    finally:
+        window.destroy()
+
+
+def bench_export(root, structure, repeat, results, workdir):
+    paths = list(index.iter_structure_files(structure))
+    out_file = os.path.join(workdir, "output.txt")
+
+    def reset_cache():
+        db = index.sqlite3.connect(index.SCAN_CACHE_FILE)
+        with db:
+            db.execute("DROP TABLE IF EXISTS blocks")
+        db.close()
+
+    stats, result = measure(lambda: index.export_files(paths, out_file), repeat, setup=reset_cache)
+    stats.update(files=len(paths), written=result["written"], chars=len(result["text"]))
+    results["export_cold"] = stats
+    results["export_cached"], _ = measure(lambda: index.export_files(paths, out_file), repeat)
+    previous = result["manifest"]
+    results["export_delta"], _ = measure(
+        lambda: index.export_files(paths, out_file, previous=previous), repeat)
+
+
+# padrões extras do --check: cobrem os caminhos do IgnoreMatcher que o
+# never_select.json não usa (sufixo, "?", "**", ancorado na raiz, só-pasta)
+CHECK_PATTERNS = ("*.log", "*~", "*.min.js", "build/", "/root_only", "docs/**/*.md", "a?c",
+                  "**/tmp", "logs/*.txt", "core_1/*.py", "cache*/", "[ab]x.py")
+
+
+def random_paths(patterns, count, seed):
+    # caminhos relativos montados com pedaços dos próprios padrões, para cair
+    # tanto nos casos que casam quanto nos vizinhos que quase casam
+    rng = random.Random(seed)
+    pieces = set(WORDS) | set(NOISE_DIRS) | {"a", "b", "abc", "x", "keep.log"}
+    for pat in patterns:
+        for part in pat.strip("/!").split("/"):
+            part = part.replace("**", "").replace("*", rng.choice(WORDS)).replace("?", "b")
+            part = part.replace("[ab]", "a")
+            if part:
+                pieces.add(part)
+    pieces = sorted(pieces)
+    exts = [""] + list(EXTENSIONS) + [".log", ".pyc", ".min.js", "~"]
+    paths = []
+    for _ in range(count):
+        parts = [rng.choice(pieces) for _ in range(rng.randint(1, 5))]
+        parts[-1] += rng.choice(exts)
+        paths.append("/".join(parts))
+    return paths
+
+
+def check_matcher(patterns, paths):
+    # IgnoreMatcher precisa dar exatamente o PathSpec.match_file: match() em
+    # qualquer caminho; match_entry()/prunes() como o walker usa (pasta de cima
+    # não ignorada; pasta podada = todo o conteúdo ignorado)
+    from pathspec import PathSpec
+    spec = PathSpec.from_lines("gitwildmatch", patterns)
+    matcher = index.IgnoreMatcher(spec, list(patterns))
+    errors = []
+    for rel in paths:
+        expected = spec.match_file(rel)
+        if matcher.match(rel) != expected:
+            errors.append(("match", rel, expected))
+        parts = rel.split("/")
+        parents = ["/".join(parts[:i]) for i in range(1, len(parts))]
+        if any(spec.match_file(p) for p in parents):
+            continue  # o walker nem chega aqui
+        pruned = [p for p in parents if matcher.prunes(p)]
+        if pruned:
+            # pasta podada não é listada: tudo dentro dela tem que ser ignorado
+            if not expected:
+                errors.append(("prunes", pruned[0], rel))
+            continue
+        if matcher.match_entry(parents[-1] if parents else "", parts[-1]) != expected:
+            errors.append(("match_entry", rel, expected))
+    return errors
+
+
+def run_check(args):
+    index._build_spec()
+    sets = {
+        "never_select.json": index.load_ignored_patterns(),
+        "extras": list(CHECK_PATTERNS),
+        "extras + negação": list(CHECK_PATTERNS) + ["!keep.log"],
+    }
+    failed = 0
+    for name, patterns in sets.items():
+        patterns = [p.replace("\\", "/") for p in patterns]
+        errors = check_matcher(patterns, random_paths(patterns, args.files, args.seed))
+        failed += len(errors)
+        print(f"{name:20} {args.files} caminhos, {len(errors)} diferenças")
+        for kind, subject, detail in errors[:10]:
+            print(f"  {kind}({subject!r}): {detail}")
+    return 1 if failed else 0
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline_file):
+    # razão atual/anterior por benchmark (>1 = ficou mais lento)
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"comparando com {baseline['meta'].get('commit')} ({baseline_file})")
+    for name, stats in current["results"].items():
+        old = baseline["results"].get(name, {})
+        if "seconds" not in stats or "seconds" not in old:
+            continue
+        ratio = stats["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        flag = "  <-- mais lento" if ratio > 1.1 else ""
+        print(f"  {name:18} {old['seconds']:9.4f}s -> {stats['seconds']:9.4f}s  x{ratio:.2f}{flag}")
+
+
+def run(args):
+    workdir = args.keep or tempfile.mkdtemp(prefix="mapeador_bench_")
+    root = os.path.join(os.path.abspath(workdir), "tree")
+    try:
+        start = time.perf_counter()
+        if not os.path.isdir(root):
+            generate_tree(root, args.files, args.seed, args.fanout, args.depth, args.noise)
+        generated = time.perf_counter() - start
+
+        # caches e saídas isolados na pasta do benchmark
+        index.SCAN_CACHE_FILE = os.path.join(workdir, "scan_cache.db")
+        index.BASE_DIR = root
+        stats, _ = measure(index._build_spec, args.repeat)
+        results = {"build_spec": stats}
+        only = set(args.only or ())
+
+        structure = bench_scan(root, args.repeat, results)
+        if not only or "ignore" in only:
+            bench_ignore(root, args.repeat, results)
+        if not only or "render" in only:
+            bench_render(root, structure, args.repeat, results)
+        if not only or "build" in only:
+            bench_build(root, structure, args.repeat, results)
+        if not only or "export" in only:
+            bench_export(root, structure, args.repeat, results, workdir)
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "files": args.files, "seed": args.seed, "fanout": args.fanout,
+                "depth": args.depth, "noise": args.noise, "repeat": args.repeat,
+                "generate_seconds": generated,
+            },
+            "results": results,
+            "counters": index.metrics.snapshot()["counters"],
+        }
+        text = json.dumps(report, indent=2)
+        if args.out == "-":
+            print(text)
+        else:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+            for name, stats in results.items():
+                print(f"{name:18} {stats['seconds']:9.4f}s" if "seconds" in stats
+                      else f"{name:18} {stats.get('skipped')}")
+        if args.compare:
+            compare(report, args.compare)
+        return 0
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do mapeador sobre uma árvore sintética.")
+    parser.add_argument("--files", type=int, default=10000, help="arquivos de código (1k a 1M)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fanout", type=int, default=8, help="arquivos por pasta, em média")
+    parser.add_argument("--depth", type=int, default=5, help="profundidade máxima das pastas")
+    parser.add_argument("--noise", type=float, default=0.3, help="fração de arquivos ignorados (node_modules...)")
+    parser.add_argument("--repeat", type=int, default=3, help="execuções por benchmark (vale a mediana)")
+    parser.add_argument("--only", action="append", choices=("ignore", "render", "build", "export"),
+                        help="roda só estes (scan sempre roda)")
+    parser.add_argument("--out", default="bench.json", help="arquivo JSON ou '-' para stdout")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--keep", help="pasta de trabalho a reaproveitar (não é apagada)")
+    parser.add_argument("--check", action="store_true",
+                        help="só confere o IgnoreMatcher contra o PathSpec em --files caminhos aleatórios")
+    args = parser.parse_args(argv)
+    return run_check(args) if args.check else run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
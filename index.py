@@ -1,21 +1,134 @@
 import os
+import re
 import json
-from pathspec import PathSpec
-import pyperclip
 from datetime import datetime
-import tkinter as tk
-from tkinter import (
-    Tk, filedialog, Checkbutton, Button, IntVar,
-    Scrollbar, Canvas, Frame, VERTICAL, BOTH, RIGHT, LEFT, Y, messagebox, simpledialog
-)
 import sys, subprocess
-
-# depois dos imports
+import argparse
+import threading, queue, time
+import sqlite3
+import io
+import codecs
+import hashlib
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from contextlib import contextmanager
+
+# tkinter, pyperclip e pathspec são importados só onde são usados:
+# o modo de linha de comando não paga a inicialização da interface
 BASE_DIR = None
 _spec = None
+_matcher = None
+
+# -- instrumentação --
+TRACE_FILE = os.environ.get("MAPEADOR_TRACE")      # JSON-lines com cada span (None = desligado)
+PROFILE_DIR = os.environ.get("MAPEADOR_PROFILE")   # pasta dos .pstats (None = desligado)
+SPAN_LABELS = (
+    ("scan", "varredura"), ("build_spec", "filtros"), ("tree_build", "árvore"),
+    ("export_read", "leitura"), ("export_write", "escrita"), ("clipboard", "clipboard"),
+    ("map_structure", "mapa"), ("dedupe", "duplicados"),
+)
+
+class Metrics(object):
+    # Spans nomeados (chamadas e tempo acumulado) e contadores, seguros entre
+    # threads. Cada span fechado vira uma linha no trace JSON-lines, se ligado.
+    def __init__(self, trace_file=None, profile_dir=None):
+        self.lock = threading.Lock()
+        self.spans = {}      # nome -> [chamadas, segundos]
+        self.counters = {}   # nome -> total
+        self.trace_file = trace_file
+        self.profile_dir = profile_dir
+        self._trace = None
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add(self, name, seconds, calls=1):
+        with self.lock:
+            span = self.spans.setdefault(name, [0, 0.0])
+            span[0] += calls
+            span[1] += seconds
+
+    @contextmanager
+    def span(self, name, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(name, elapsed)
+            if self.trace_file:
+                self._write_trace(name, elapsed, fields)
+
+    def _write_trace(self, name, elapsed, fields):
+        record = {"ts": time.time(), "span": name, "ms": round(elapsed * 1000, 3),
+                  "thread": threading.current_thread().name}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            if self._trace is None:
+                self._trace = open(self.trace_file, "a", encoding="utf-8")
+            self._trace.write(line)
+            self._trace.flush()
+
+    @contextmanager
+    def profile(self, name):
+        # roda o bloco sob cProfile e salva <pasta>/<nome>-<hora>.pstats
+        if not self.profile_dir:
+            yield
+            return
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # outro profiler já ativo (ex.: duas ações ao mesmo tempo no 3.12+)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{name}-{stamp}.pstats"))
+
+    def snapshot(self):
+        with self.lock:
+            return {"spans": {k: {"calls": c, "seconds": s} for k, (c, s) in self.spans.items()},
+                    "counters": dict(self.counters)}
+
+    def summary(self):
+        # linha da barra de status: tempos acumulados e contadores
+        with self.lock:
+            parts = [f"{label} {self.spans[name][1]:.2f}s" for name, label in SPAN_LABELS
+                     if name in self.spans]
+            c = self.counters
+            if "entries_scanned" in c:
+                parts.append(f"{c['entries_scanned']:,} entradas ({c.get('entries_ignored', 0):,} ignoradas)"
+                             .replace(",", "."))
+            if "bytes_read" in c:
+                parts.append(f"{c['bytes_read'] / (1024 * 1024):.1f} MB lidos")
+            if "widgets" in c:
+                parts.append(f"{c['widgets']:,} itens".replace(",", "."))
+        return " | ".join(parts)
+
+    def close(self):
+        with self.lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+metrics = Metrics(TRACE_FILE, PROFILE_DIR)
+METRICS_REFRESH_MS = 1000  # atualização da barra de status
 
 
 def show_toast(window, msg, duration=2000):
+    import tkinter as tk
     toast = tk.Toplevel(window)
     toast.overrideredirect(True)
     toast.attributes("-topmost", True)
@@ -23,9 +136,11 @@ def show_toast(window, msg, duration=2000):
     window.update_idletasks()
     x = window.winfo_rootx() + (window.winfo_width() // 2) - 100
     y = window.winfo_rooty() + window.winfo_height() - 80
-    toast.geometry(f"350x40+{x}+{y}")
-    label = tk.Label(toast, text=msg, bg="#444", fg="white", font=("Segoe UI", 11), bd=2, relief="solid")
-    label.pack(fill=BOTH, expand=True)
+    extra = 22 * msg.count("\n")
+    toast.geometry(f"350x{40 + extra}+{x}+{y - extra}")
+    label = tk.Label(toast, text=msg, bg="#444", fg="white", font=("Segoe UI", 11), bd=2, relief="solid",
+                     wraplength=340)
+    label.pack(fill=tk.BOTH, expand=True)
     toast.after(duration, toast.destroy)
 
 IGNORED_FILE = "never_select.json"
@@ -37,44 +152,161 @@ IGNORED_PATTERNS = [
     ".nuxt", ".yarn", "yarn.lock", "package-lock.json", "*.lock", "Thumbs.db", ".sass-cache", ".cache","linux", "windows", "macos"
 ]
 
-HISTORY_FILE = "selection_state.json"
+HISTORY_FILE = "selection_state.json"   # formato antigo, migrado automaticamente
+HISTORY_DB = "selection_state.db"
 MAX_HISTORY = 30
 
-def load_history():
+def _load_legacy_history(path=None):
     try:
-        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
+        with open(path or HISTORY_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)
             return data.get("history", [])
     except Exception:
         return []
 
-def save_history(history):
-    with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump({"history": history[:MAX_HISTORY]}, f, indent=2, ensure_ascii=False)
-
-def add_or_update_history(history, path, selected, name=None):
-    # Remove duplicata pelo path
-    for i, entry in enumerate(history):
-        if os.path.normcase(entry['path']) == os.path.normcase(path):
-            # Atualiza seleção e data se já existir
-            entry['selected'] = selected
-            entry['saved_at'] = datetime.now().isoformat()
-            if name:
-                entry['name'] = name
-            # Move para o topo
-            history.insert(0, history.pop(i))
-            break
-    else:
-        # Adiciona novo no topo
-        history.insert(0, {
-            "path": path,
-            "selected": selected,
-            "saved_at": datetime.now().isoformat(),
-            "name": name or os.path.basename(path) or "Histórico"
-        })
-    # Limita tamanho do histórico
-    del history[MAX_HISTORY:]
-    return history
+def _relative_to(root, path):
+    # caminho relativo à raiz da entrada (ou absoluto, se estiver fora dela)
+    prefix = root if root.endswith(("/", os.sep)) else root + os.sep
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+class HistoryStore(object):
+    # Histórico em SQLite: uma linha por entrada e uma tabela com os caminhos
+    # selecionados, relativos à pasta da entrada. A lista de entradas fica em
+    # memória e cada seleção só é lida do banco quando pedida.
+    def __init__(self, db_path=None, legacy_file=None):
+        self.db = sqlite3.connect(db_path or HISTORY_DB)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        with self.db:
+            self.db.executescript(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, path TEXT NOT NULL,"
+                " name TEXT NOT NULL, saved_at TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS paths ("
+                " entry_id INTEGER NOT NULL REFERENCES entries(id) ON DELETE CASCADE,"
+                " rel TEXT NOT NULL, PRIMARY KEY (entry_id, rel)) WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS exports ("
+                " entry_id INTEGER NOT NULL REFERENCES entries(id) ON DELETE CASCADE,"
+                " rel TEXT NOT NULL, digest TEXT NOT NULL, PRIMARY KEY (entry_id, rel)) WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            )
+        self._entries = None
+        self._selections = {}
+        self._migrate(legacy_file or HISTORY_FILE)
+
+    def _migrate(self, legacy_file):
+        # importa uma única vez o selection_state.json antigo
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'legacy_migrated'").fetchone():
+            return
+        legacy = _load_legacy_history(legacy_file) if os.path.exists(legacy_file) else []
+        with self.db:
+            for entry in reversed(legacy[:MAX_HISTORY]):
+                path = entry.get("path")
+                if not path:
+                    continue
+                cur = self.db.execute(
+                    "INSERT OR IGNORE INTO entries (key, path, name, saved_at) VALUES (?, ?, ?, ?)",
+                    (os.path.normcase(path), path, entry.get("name") or os.path.basename(path) or "Histórico",
+                     entry.get("saved_at") or datetime.now().isoformat()))
+                if cur.rowcount:
+                    self.db.executemany(
+                        "INSERT OR IGNORE INTO paths (entry_id, rel) VALUES (?, ?)",
+                        [(cur.lastrowid, _relative_to(path, p)) for p in entry.get("selected", [])])
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('legacy_migrated', ?)",
+                            (datetime.now().isoformat(),))
+
+    def entries(self):
+        # entradas da mais recente para a mais antiga (sem a seleção)
+        if self._entries is None:
+            self._entries = [
+                {"id": id_, "path": path, "name": name, "saved_at": saved_at}
+                for id_, path, name, saved_at in self.db.execute(
+                    "SELECT id, path, name, saved_at FROM entries ORDER BY saved_at DESC, id DESC")
+            ]
+        return self._entries
+
+    def find(self, path):
+        key = os.path.normcase(path)
+        return next((e for e in self.entries() if os.path.normcase(e["path"]) == key), None)
+
+    def selection(self, entry):
+        # caminhos absolutos salvos para a entrada (carregados sob demanda)
+        sel = self._selections.get(entry["id"])
+        if sel is None:
+            root = entry["path"]
+            sel = self._selections[entry["id"]] = [
+                os.path.join(root, rel) for rel, in self.db.execute(
+                    "SELECT rel FROM paths WHERE entry_id = ?", (entry["id"],))
+            ]
+        return sel
+
+    def save_selection(self, path, selected, name=None):
+        # cria/atualiza a entrada da pasta, leva para o topo e grava só a diferença
+        now = datetime.now().isoformat()
+        entry = self.find(path)
+        with self.db:
+            if entry is None:
+                name = name or os.path.basename(path) or "Histórico"
+                cur = self.db.execute(
+                    "INSERT INTO entries (key, path, name, saved_at) VALUES (?, ?, ?, ?)",
+                    (os.path.normcase(path), path, name, now))
+                entry = {"id": cur.lastrowid, "path": path, "name": name, "saved_at": now}
+                old = set()
+            else:
+                entry["saved_at"] = now
+                if name:
+                    entry["name"] = name
+                self.db.execute("UPDATE entries SET saved_at = ?, name = ? WHERE id = ?",
+                                (now, entry["name"], entry["id"]))
+                old = {rel for rel, in self.db.execute(
+                    "SELECT rel FROM paths WHERE entry_id = ?", (entry["id"],))}
+            new = {_relative_to(entry["path"], p) for p in selected}
+            self.db.executemany("DELETE FROM paths WHERE entry_id = ? AND rel = ?",
+                                [(entry["id"], rel) for rel in old - new])
+            self.db.executemany("INSERT INTO paths (entry_id, rel) VALUES (?, ?)",
+                                [(entry["id"], rel) for rel in new - old])
+            # limita o tamanho do histórico
+            self.db.execute(
+                "DELETE FROM entries WHERE id NOT IN"
+                " (SELECT id FROM entries ORDER BY saved_at DESC, id DESC LIMIT ?)", (MAX_HISTORY,))
+        self._selections[entry["id"]] = list(selected)
+        entries = [e for e in self.entries() if e["id"] != entry["id"]]
+        self._entries = [entry] + entries[:MAX_HISTORY - 1]
+        return entry
+
+    def last_export(self, entry):
+        # {caminho absoluto: hash} do último export da entrada
+        root = entry["path"]
+        return {os.path.join(root, rel): digest for rel, digest in self.db.execute(
+            "SELECT rel, digest FROM exports WHERE entry_id = ?", (entry["id"],))}
+
+    def save_export(self, entry, manifest):
+        with self.db:
+            self.db.execute("DELETE FROM exports WHERE entry_id = ?", (entry["id"],))
+            self.db.executemany(
+                "INSERT INTO exports (entry_id, rel, digest) VALUES (?, ?, ?)",
+                [(entry["id"], _relative_to(entry["path"], p), d) for p, d in manifest.items()])
+
+    def rename(self, entry, name):
+        with self.db:
+            self.db.execute("UPDATE entries SET name = ? WHERE id = ?", (name, entry["id"]))
+        entry["name"] = name
+
+    def remove(self, entry):
+        with self.db:
+            self.db.execute("DELETE FROM entries WHERE id = ?", (entry["id"],))
+        self._selections.pop(entry["id"], None)
+        self._entries = [e for e in self.entries() if e["id"] != entry["id"]]
+
+_history_store = None
+
+def get_history_store():
+    global _history_store
+    if _history_store is None:
+        _history_store = HistoryStore()
+    return _history_store
+
+def history_display_name(entry):
+    return entry.get("name") or os.path.basename(entry.get("path") or "") or "Nenhuma pasta"
 
 class ToolTip(object):
     def __init__(self, widget, text=''):
@@ -87,6 +319,7 @@ class ToolTip(object):
     def showtip(self, event=None):
         if self.tipwindow or not self.text:
             return
+        import tkinter as tk
         x = self.widget.winfo_rootx() + 20
         y = self.widget.winfo_rooty() + self.widget.winfo_height() + 1
         self.tipwindow = tw = tk.Toplevel(self.widget)
@@ -103,28 +336,30 @@ class ToolTip(object):
         if tw:
             tw.destroy()
 
-def rename_item(listbox, index, history):
-    old_name = history[index]['name']
+def rename_item(listbox, index, store):
+    from tkinter import simpledialog
+    entry = store.entries()[index]
+    old_name = entry['name']
     new_name = simpledialog.askstring(
         "Renomear",
         "Informe novo nome (máx 30 caracteres):",
         initialvalue=old_name)
     if new_name:
         new_name = new_name.strip()[:30]
-        history[index]['name'] = new_name
-        save_history(history)
+        store.rename(entry, new_name)
         listbox.delete(index)
         listbox.insert(index, new_name)
 
-def create_history_listbox(parent, history):
+def create_history_listbox(parent, store):
+    import tkinter as tk
     listbox = tk.Listbox(parent, font=("Segoe UI", 11), height=15)
     listbox.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-    for entry in history:
-        display_name = entry.get("name") or os.path.basename(entry.get("path") or "") or "Nenhuma pasta"
-        listbox.insert(tk.END, display_name)
+    for entry in store.entries():
+        listbox.insert(tk.END, history_display_name(entry))
 
     def on_motion(event):
         idx = listbox.nearest(event.y)
+        history = store.entries()
         if 0 <= idx < len(history):
             path = history[idx]['path']
             tip_text = path if path else "Nenhuma pasta associada"
@@ -141,15 +376,8 @@ def create_history_listbox(parent, history):
     listbox.bind("<Leave>", on_leave)
     def on_rename(event):
         idx = listbox.nearest(event.y)
-        # Busca o histórico atualizado (sempre sincronizado)
-        hist = load_history()
-        if 0 <= idx < len(hist):
-            rename_item(listbox, idx, hist)
-            # Após renomear, atualiza o listbox inteiro para evitar mismatch
-            listbox.delete(0, tk.END)
-            for entry in hist:
-                display_name = entry.get("name") or os.path.basename(entry.get("path") or "") or "Nenhuma pasta"
-                listbox.insert(tk.END, display_name)
+        if 0 <= idx < len(store.entries()):
+            rename_item(listbox, idx, store)
     listbox.bind("<Double-Button-1>", on_rename)
 
     return listbox
@@ -168,48 +396,2608 @@ def load_ignored_patterns():
             out.append(p)
     return out
 
-    
+
+_LITERAL = re.compile(r"[\w.\-+@~,=%]+")
+
+class IgnoreMatcher(object):
+    # Camada compilada na frente do PathSpec, com o mesmo resultado do match_file:
+    #  - nomes simples ("node_modules", ".git") e pastas ("vendor/") em sets;
+    #  - "*.ext" numa tabela de extensões e "*sufixo" num endswith;
+    #  - o resto vira uma regex única, separada pelo 1º segmento quando o
+    #    padrão é ancorado na raiz ("storage/framework/", "public/hot").
+    # Com padrões de negação ("!x") tudo volta para o PathSpec.
+    def __init__(self, spec, patterns):
+        self.spec = spec
+        self.fallback = any(p.startswith("!") for p in patterns)
+        self.names, self.dir_names, self.exts = set(), set(), set()
+        suffixes, floating, anchored = [], [], {}
+        for pat, compiled in zip(patterns, spec.patterns):
+            if compiled.include is None:
+                continue
+            body = pat[:-1] if pat.endswith("/") else pat
+            if _LITERAL.fullmatch(body) and body.strip("."):
+                (self.dir_names if pat.endswith("/") else self.names).add(body)
+            elif (body.startswith("*") and not pat.endswith("/")
+                    and _LITERAL.fullmatch(body[1:]) and body[1:].strip(".")):
+                suffix = body[1:]
+                if suffix.startswith(".") and "." not in suffix[1:]:
+                    self.exts.add(suffix[1:])
+                else:
+                    suffixes.append(suffix)
+            else:
+                # remove grupos nomeados (o pathspec repete "ps_d" em todos)
+                rx = re.sub(r"\(\?P<\w+>", "(?:", compiled.regex.pattern)
+                first, sep, rest = body.lstrip("/").partition("/")
+                if (sep or body.startswith("/")) and _LITERAL.fullmatch(first):
+                    anchored.setdefault(first, []).append(rx)
+                else:
+                    floating.append(rx)
+        self.suffixes = tuple(suffixes)
+        self._floating = floating
+        self._anchored = anchored
+        self._regex_cache = {}
+
+    def _regex_for(self, top):
+        # regex combinada válida para caminhos cujo 1º segmento é "top" (em cache)
+        try:
+            return self._regex_cache[top]
+        except KeyError:
+            parts = self._floating + self._anchored.get(top, [])
+            rx = re.compile("|".join(f"(?:{p})" for p in parts)) if parts else None
+            self._regex_cache[top] = rx
+            return rx
+
+    def _name_matches(self, name):
+        if name in self.names:
+            return True
+        i = name.rfind(".")
+        if i >= 0 and name[i + 1:] in self.exts:
+            return True
+        return bool(self.suffixes) and name.endswith(self.suffixes)
+
+    def match(self, rel):
+        # equivalente a spec.match_file(rel) para um caminho relativo POSIX
+        if self.fallback or rel in (".", "..") or rel.startswith(("./", "../", "/")):
+            return self.spec.match_file(rel)
+        parts = rel.split("/")
+        for i, name in enumerate(parts):
+            if self._name_matches(name) or (i < len(parts) - 1 and name in self.dir_names):
+                return True
+        rx = self._regex_for(parts[0])
+        return rx is not None and rx.match(rel) is not None
+
+    def match_entry(self, parent_rel, name):
+        # entrada direta de uma pasta que não foi ignorada nem podada: os
+        # componentes de cima já passaram, então só o nome e as regex contam
+        rel = f"{parent_rel}/{name}" if parent_rel else name
+        if self.fallback:
+            return self.spec.match_file(rel)
+        if self._name_matches(name):
+            return True
+        rx = self._regex_for(parent_rel.partition("/")[0] if parent_rel else name)
+        return rx is not None and rx.match(rel) is not None
+
+    def prunes(self, rel):
+        # True quando todo o conteúdo da pasta é ignorado ("vendor/", "public/css/"):
+        # a pasta continua aparecendo (vazia), mas não precisa ser listada
+        if self.fallback:
+            return False
+        if rel.rpartition("/")[2] in self.dir_names:
+            return True
+        rx = self._regex_for(rel.partition("/")[0])
+        return rx is not None and rx.match(rel + "/") is not None
+
 def _build_spec():
-    global _spec
+    global _spec, _matcher
     # usa os padrões default + os do arquivo JSON
     pats = load_ignored_patterns()
     # normaliza separadores para POSIX
     pats = [p.replace("\\", "/") for p in pats]
-    # "gitwildmatch" = semântica de .gitignore
-    _spec = PathSpec.from_lines("gitwildmatch", pats)
+    with metrics.span("build_spec", patterns=len(pats)):
+        # "gitwildmatch" = semântica de .gitignore
+        from pathspec import PathSpec
+        _spec = PathSpec.from_lines("gitwildmatch", pats)
+        _matcher = IgnoreMatcher(_spec, pats)
 
 
-def should_ignore(path: str) -> bool:
+# .gitignore/.ignore de cada pasta (o .ignore vem depois e tem precedência)
+HONOR_GITIGNORE = True
+LOCAL_IGNORE_FILES = (".gitignore", ".ignore")
+_local_specs = {}  # caminho do arquivo -> ((mtime_ns, tamanho), PathSpec | None)
+
+def _load_local_spec(path):
+    # PathSpec de um .gitignore, recompilado só quando o arquivo muda
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _local_specs.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    from pathspec import PathSpec
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            spec = PathSpec.from_lines("gitwildmatch", f)
+    except OSError:
+        spec = None
+    if spec is not None and not any(p.include is not None for p in spec.patterns):
+        spec = None
+    _local_specs[path] = (key, spec)
+    return spec
+
+def _add_local_layers(layers, folder, names):
+    # acrescenta as regras locais da pasta às herdadas das pastas de cima
+    if not HONOR_GITIGNORE:
+        return layers
+    for fname in LOCAL_IGNORE_FILES:
+        if fname in names:
+            spec = _load_local_spec(os.path.join(folder, fname))
+            if spec is not None:
+                layers = layers + ((folder, spec),)
+    return layers
+
+_local_layers = {}  # (base, pasta) -> camadas de base até a pasta (sem stat a cada should_ignore)
+
+def forget_local_layers():
+    # um .gitignore/.ignore mudou ou começou outra varredura: as camadas são refeitas
+    # (e os arquivos de ignore conferidos de novo) na próxima consulta
+    _local_layers.clear()
+
+def _local_layers_for(path, base, include_self=True):
+    # camadas de .gitignore/.ignore de base até path, guardadas por pasta
+    if not include_self:
+        if not _relative_root(path, base):
+            return ()  # a própria base (ou fora dela): nada acima
+        path = os.path.dirname(path)
+    layers = _local_layers.get((base, path))
+    if layers is not None:
+        return layers
+    rel = _relative_root(path, base)
+    if rel is None:
+        folders = [path]
+    else:
+        folders, cur = [base], base
+        for part in rel.split("/") if rel else []:
+            cur = os.path.join(cur, part)
+            folders.append(cur)
+    layers = ()
+    for folder in folders:
+        cached = _local_layers.get((base, folder))
+        if cached is None:
+            cached = _local_layers[(base, folder)] = _add_local_layers(layers, folder, LOCAL_IGNORE_FILES)
+        layers = cached
+    _local_layers[(base, path)] = layers
+    return layers
+
+def _local_ignored(layers, full, is_dir):
+    # semântica do git: o arquivo mais fundo decide; dentro dele vale o último
+    # padrão que casar (inclusive "!negação")
+    for folder, spec in reversed(layers):
+        local = full[len(folder) + (not folder.endswith(("/", os.sep))):]  # raiz "/" ou "C:/"
+        if os.sep != "/":
+            local = local.replace(os.sep, "/")
+        if is_dir:
+            local += "/"
+        for pattern in reversed(spec.patterns):
+            if pattern.include is not None and pattern.regex.match(local):
+                return pattern.include
+    return False
+
+def should_ignore(path: str, base: str = None) -> bool:
     # garante que o spec exista
     if _spec is None:
         _build_spec()
     # compara caminho RELATIVO à raiz selecionada, com separadores POSIX
-    base = BASE_DIR or os.getcwd()
+    base = base or BASE_DIR or os.getcwd()
     rel = os.path.relpath(path, base).replace("\\", "/")
-    return _spec.match_file(rel)
-
-def get_directory_structure(path):
-    structure = {}
+    if _matcher.match(rel):
+        return True
+    if HONOR_GITIGNORE:
+        layers = _local_layers_for(os.path.dirname(path), base)
+        return bool(layers) and _local_ignored(layers, path, os.path.isdir(path))
+    return False
+
+SCAN_CACHE_FILE = "scan_cache.db"
+SCAN_CACHE_ENABLED = True
+# pastas alteradas há menos que isso não entram no cache: o mtime pode ter
+# resolução de segundos (FAT/SMB) e uma mudança logo depois passaria batida
+SCAN_CACHE_RACY_NS = 2_000_000_000
+
+class ScanIndex(object):
+    # Índice em disco (SQLite) com a listagem crua de cada pasta e o mtime dela.
+    # Numa nova varredura só as pastas cujo mtime mudou são relidas com scandir.
+    def __init__(self, root, db_path=None):
+        self.root = root
+        self.db = sqlite3.connect(db_path or SCAN_CACHE_FILE, timeout=5)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS dirs ("
+            " root TEXT NOT NULL, rel TEXT NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " entries TEXT NOT NULL, PRIMARY KEY (root, rel))"
+        )
+        self.rows = {
+            rel: (mtime_ns, entries)
+            for rel, mtime_ns, entries in self.db.execute(
+                "SELECT rel, mtime_ns, entries FROM dirs WHERE root = ?", (root,))
+        }
+        self.changed = {}
+        self.seen = set()
+
+    def _rel(self, path):
+        # _relative_to: raiz de disco ("C:/", "/") já termina no separador
+        return _relative_to(self.root, path) if path != self.root else ""
+
+    def lookup(self, path):
+        # devolve (mtime_ns, listagem ou None se precisar reler a pasta)
+        rel = self._rel(path)
+        self.seen.add(rel)
+        mtime_ns = os.stat(path).st_mtime_ns
+        row = self.rows.get(rel)
+        if row is not None and row[0] == mtime_ns:
+            entries = json.loads(row[1])
+            # linhas antigas, sem o tamanho: relê a pasta
+            if all(len(e) == 3 for e in entries):
+                return mtime_ns, [(name, bool(is_dir), size) for name, is_dir, size in entries]
+        return mtime_ns, None
+
+    def remember(self, path, mtime_ns, listing):
+        if time.time_ns() - mtime_ns < SCAN_CACHE_RACY_NS:
+            mtime_ns = -1
+        self.changed[self._rel(path)] = (mtime_ns, json.dumps(
+            [(name, int(is_dir), size) for name, is_dir, size in listing],
+            ensure_ascii=False, separators=(",", ":")))
+
+    def close(self, prune=True):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO dirs (root, rel, mtime_ns, entries) VALUES (?, ?, ?, ?)",
+                [(self.root, rel, m, e) for rel, (m, e) in self.changed.items()])
+            # varredura completa: some com as pastas que não existem mais (ou foram ignoradas)
+            if prune:
+                gone = [(self.root, rel) for rel in self.rows.keys() - self.seen]
+                self.db.executemany("DELETE FROM dirs WHERE root = ? AND rel = ?", gone)
+        self.db.close()
+
+def list_directory(path, index=None):
+    # listagem crua da pasta, sem filtros: [(nome, é_pasta, tamanho)].
+    # O tamanho vem do mesmo scandir (de graça no Windows; um lstat no resto) e,
+    # com o cache, é o da última listagem: editar um arquivo não muda o mtime da
+    # pasta, então quem precisa do valor atual confere com restat_sizes
+    mtime_ns = None
+    if index is not None:
+        try:
+            mtime_ns, cached = index.lookup(path)
+        except OSError:
+            cached = None
+        if cached is not None:
+            return cached
+    listing = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                size = 0 if is_dir else entry.stat(follow_symlinks=False).st_size
+                listing.append((entry.name, is_dir, size))
+            except OSError:
+                # symlink quebrado/sem permissão: ignora
+                continue
+    if mtime_ns is not None:
+        index.remember(path, mtime_ns, listing)
+    return listing
+
+def restat_sizes(paths, sizes, cancel=None):
+    # eventos ("size", arquivo, bytes) dos arquivos cujo tamanho mudou desde a
+    # listagem; só para os que importam (os marcados), não para a árvore toda
+    events = []
+    for path in paths:
+        if cancel is not None and cancel.is_set():
+            break
+        try:
+            size = os.lstat(path).st_size
+        except OSError:
+            continue
+        if size != sizes.get(path):
+            events.append(("size", path, size))
+    return events
+
+def _relative_root(path, base):
+    # caminho relativo (POSIX) da raiz da varredura em relação a BASE_DIR;
+    # None quando ela está fora da base e o caminho rápido não se aplica
+    try:
+        rel = os.path.relpath(path, base).replace("\\", "/")
+    except ValueError:
+        return None
+    if rel == ".":
+        return ""
+    if rel == ".." or rel.startswith("../"):
+        return None
+    return rel
+
+# varredura paralela: em SMB/NFS cada scandir é dominado pela latência da rede,
+# então várias pastas são listadas ao mesmo tempo num pool de threads
+SCAN_WORKERS = None           # None = automático (paralelo só em pasta de rede); 1 = sequencial
+SCAN_NETWORK_WORKERS = 16     # threads usadas no modo paralelo
+SCAN_MAX_OPEN = 32            # scandir/.gitignore abertos ao mesmo tempo
+_NETWORK_FS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "9p", "ncpfs", "davfs",
+               "fuse.sshfs", "fuse.rclone", "fuse.s3fs"}
+
+def is_network_path(path):
+    # pasta montada de um compartilhamento de rede?
+    path = os.path.abspath(path)
+    if os.name == "nt":
+        if path.startswith("\\\\"):
+            return True  # caminho UNC
+        try:
+            import ctypes
+            drive = os.path.splitdrive(path)[0] + "\\"
+            return ctypes.windll.kernel32.GetDriveTypeW(drive) == 4  # DRIVE_REMOTE
+        except (AttributeError, OSError):
+            return False
+    try:
+        with open("/proc/self/mounts", "r", encoding="utf-8", errors="replace") as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False  # sem /proc (macOS/BSD): escolha SCAN_WORKERS na mão
+    best, fstype = "", None
+    for point, kind in mounts:
+        point = point.replace("\\040", " ")
+        if path == point or path.startswith(point.rstrip("/") + "/"):
+            if len(point) >= len(best):
+                best, fstype = point, kind
+    return fstype in _NETWORK_FS
+
+def scan_workers_for(path):
+    if SCAN_WORKERS is not None:
+        return max(1, SCAN_WORKERS)
+    return SCAN_NETWORK_WORKERS if is_network_path(path) else 1
+
+def _scan_folder(current, rel, pruned, layers, matcher, base, index, sizes=None):
+    # lista e filtra uma pasta: (entradas, [(subpasta, rel, podada?, camadas)]);
+    # com "sizes" ({caminho: bytes}) guarda também o tamanho dos arquivos
+    entries, dirs = [], []
+    if pruned:
+        return entries, dirs
     try:
-        with os.scandir(path) as it:
-            for entry in it:
-                full = entry.path
-                if should_ignore(full):
+        listing = list_directory(current, index)
+        layers = _add_local_layers(layers, current, {entry[0] for entry in listing})
+        for name, is_dir, size in listing:
+            full = os.path.join(current, name)
+            if rel is None:
+                if matcher.match(os.path.relpath(full, base).replace("\\", "/")):
                     continue
-                try:
-                    if entry.is_dir(follow_symlinks=False):
-                        structure[full] = get_directory_structure(full)
-                    else:
-                        structure[full] = None
-                except OSError:
-                    # symlink quebrado/sem permissão: ignora
+                child_rel = None
+            else:
+                if matcher.match_entry(rel, name):
                     continue
+                child_rel = f"{rel}/{name}" if rel else name
+            # .gitignore aninhados: pastas ignoradas nem chegam a ser listadas
+            if layers and _local_ignored(layers, full, is_dir):
+                continue
+            entries.append((full, is_dir))
+            if is_dir:
+                dirs.append((full, child_rel, child_rel is not None and matcher.prunes(child_rel), layers))
+            elif sizes is not None:
+                sizes[full] = size
+        metrics.count("entries_scanned", len(listing))
+        metrics.count("entries_ignored", len(listing) - len(entries))
     except PermissionError:
         pass
+    return entries, dirs
+
+def _walk_sequential(start, scan, cancel):
+    # pré-ordem, uma pasta por vez; devolve True se chegou ao fim
+    stack = [start]
+    while stack:
+        if cancel is not None and cancel.is_set():
+            return False
+        task = stack.pop()
+        entries, dirs = scan(*task)
+        yield task[0], entries
+        # empilha ao contrário para manter a ordem do scandir
+        stack.extend(reversed(dirs))
+    return True
+
+def _walk_parallel(start, scan, cancel, workers):
+    # cada pasta é uma tarefa no pool; os lotes saem na ordem em que ficam
+    # prontos, mas uma pasta sempre sai antes das subpastas dela
+    handles = threading.BoundedSemaphore(SCAN_MAX_OPEN)
+
+    def run(task):
+        with handles:
+            return scan(*task)
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+    pending = {}
+    try:
+        pending[pool.submit(run, start)] = start[0]
+        while pending:
+            if cancel is not None and cancel.is_set():
+                return False
+            done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                if cancel is not None and cancel.is_set():
+                    return False
+                current = pending.pop(future)
+                entries, dirs = future.result()
+                for task in dirs:
+                    pending[pool.submit(run, task)] = task[0]
+                yield current, entries
+        return True
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+def walk_directory(path, cancel=None, use_cache=None, workers=None, sizes=None):
+    # percorre devolvendo (pasta, [(caminho, é_pasta), ...]) por pasta, em pré-ordem
+    # no modo sequencial; "cancel" é um threading.Event opcional para interromper.
+    # workers > 1 lista as pastas em paralelo (None = scan_workers_for(path));
+    # "sizes" recebe o tamanho de cada arquivo antes do lote sair
+    base = BASE_DIR or os.getcwd()
+    if _spec is None:
+        _build_spec()
+    matcher = _matcher
+    root_rel = _relative_root(path, base)
+    if use_cache is None:
+        use_cache = SCAN_CACHE_ENABLED
+    if workers is None:
+        workers = scan_workers_for(path)
+    index = ScanIndex(path) if use_cache else None
+    completed = False
+    try:
+        pruned = False
+        if root_rel:
+            # varredura de uma subpasta: herda o que as pastas de cima ignoram
+            prefix = ""
+            for part in root_rel.split("/"):
+                prefix = f"{prefix}/{part}" if prefix else part
+                if matcher.match(prefix) or matcher.prunes(prefix):
+                    pruned = True
+                    break
+        layers = _local_layers_for(path, base, include_self=False) if HONOR_GITIGNORE else ()
+        # tarefa = (pasta, caminho relativo, podada?, regras de .gitignore)
+        start = (path, root_rel, pruned, layers)
+
+        def scan(current, rel, pruned, layers):
+            return _scan_folder(current, rel, pruned, layers, matcher, base, index, sizes)
+
+        if workers > 1:
+            completed = yield from _walk_parallel(start, scan, cancel, workers)
+        else:
+            completed = yield from _walk_sequential(start, scan, cancel)
+    finally:
+        if index is not None:
+            index.close(prune=completed)
+
+# -- listagem pelo git: em repositórios a lista de arquivos já existe no
+# .git/index; pastas ignoradas (node_modules, build...) nem são visitadas
+USE_GIT_INDEX = False  # lista pelo git em vez de varrer o disco (cai no walker fora de repositório)
+GIT_TIMEOUT = 30       # segundos por chamada ao git
+
+def find_git_dir(path):
+    # (topo da work tree, pasta do repositório) que contém path, ou None
+    cur = os.path.abspath(path)
+    while True:
+        dot = os.path.join(cur, ".git")
+        if os.path.isdir(dot):
+            return cur, dot
+        if os.path.isfile(dot):
+            # worktree/submódulo: ".git" é um arquivo "gitdir: <caminho>"
+            try:
+                with open(dot, "r", encoding="utf-8") as f:
+                    line = f.readline().strip()
+            except OSError:
+                return None
+            if line.startswith("gitdir:"):
+                return cur, os.path.join(cur, line[len("gitdir:"):].strip())
+            return None
+        parent = os.path.dirname(cur)
+        if parent == cur:
+            return None
+        cur = parent
+
+def _varint(data, pos):
+    # inteiro de tamanho variável do index v4 (o mesmo "offset" dos packs)
+    c = data[pos]
+    pos += 1
+    value = c & 127
+    while c & 128:
+        c = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (c & 127)
+    return value, pos
+
+def read_git_index(git_dir):
+    # entradas do .git/index (versões 2 a 4): [(caminho relativo ao topo, é_pasta)].
+    # Pula skip-worktree (sparse checkout) e repete uma vez só os caminhos em conflito;
+    # submódulos e diretórios esparsos entram como pastas
+    with open(os.path.join(git_dir, "index"), "rb") as f:
+        data = f.read()
+    signature, version, count = struct.unpack_from(">4sII", data, 0)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"índice do git não suportado (versão {version})")
+    entries, seen, prev, pos = [], set(), b"", 12
+    for _ in range(count):
+        mode = struct.unpack_from(">I", data, pos + 24)[0]
+        flags = struct.unpack_from(">H", data, pos + 60)[0]
+        name_at, extended = pos + 62, 0
+        if version >= 3 and flags & 0x4000:
+            extended = struct.unpack_from(">H", data, name_at)[0]
+            name_at += 2
+        if version == 4:
+            # nome comprimido: tira N bytes do fim do anterior e acrescenta o sufixo
+            strip, name_at = _varint(data, name_at)
+            end = data.index(b"\0", name_at)
+            name = prev[:len(prev) - strip] + data[name_at:end]
+            pos = end + 1
+        else:
+            end = data.index(b"\0", name_at)
+            name = data[name_at:end]
+            pos += (end - pos + 8) & ~7  # 1 a 8 NULs de preenchimento
+        prev = name
+        if extended & 0x4000 or name in seen:
+            continue
+        seen.add(name)
+        kind = mode & 0o170000
+        entries.append((os.fsdecode(name.rstrip(b"/")), kind in (0o160000, 0o040000)))
+    return entries
+
+def _git_ls_files(root, *queries):
+    # roda as consultas ao mesmo tempo; uma lista de caminhos por consulta
+    procs = [subprocess.Popen(["git", "-C", root, "ls-files", "-z", *args],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+             for args in queries]
+    results = []
+    try:
+        for proc, args in zip(procs, queries):
+            out, _ = proc.communicate(timeout=GIT_TIMEOUT)
+            if proc.returncode:
+                raise subprocess.CalledProcessError(proc.returncode, args)
+            results.append([os.fsdecode(p) for p in out.split(b"\0") if p])
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+    return results
+
+def git_list_files(path):
+    # [(caminho relativo a path, é_pasta)] rastreados + não rastreados e não ignorados;
+    # None quando path não está num repositório
+    found = find_git_dir(path)
+    if found is None:
+        return None
+    top, git_dir = found
+    try:
+        cached, deleted, others = _git_ls_files(
+            path, ("--cached", "--stage", "-t"), ("--deleted",), ("--others", "--exclude-standard"))
+        files, seen = [], set()
+        for record in cached:
+            # "H 100644 <sha> 0\tcaminho"; S = skip-worktree (fora do sparse checkout)
+            tag, meta, rel = record[0], record[2:].split("\t", 1)[0], record.split("\t", 1)[1]
+            if tag == "S" or rel in seen:
+                continue
+            seen.add(rel)
+            files.append((rel, meta.startswith("160000")))
+        deleted = set(deleted)
+        files = [f for f in files if f[0] not in deleted]
+        # repositório aninhado não rastreado sai como "pasta/": entra como pasta (vazia, como um submódulo)
+        files.extend((rel.rstrip("/"), True) if rel.endswith("/") else (rel, False) for rel in others)
+        return files
+    except (OSError, subprocess.SubprocessError):
+        pass
+    # sem o executável do git (ou repositório recusado): só os rastreados, direto do índice
+    try:
+        entries = read_git_index(git_dir)
+    except (OSError, ValueError, struct.error):
+        return None
+    prefix = _relative_root(path, top)
+    if prefix is None:
+        return None
+    if not prefix:
+        return entries
+    cut = len(prefix) + 1
+    return [(rel[cut:], is_dir) for rel, is_dir in entries if rel.startswith(prefix + "/")]
+
+def walk_git(path, cancel=None, sizes=None):
+    # mesmos lotes do walk_directory, montados da lista do git e filtrados pelo
+    # IGNORED_PATTERNS; None quando não dá (sem repositório / raiz fora da base)
+    base = BASE_DIR or os.getcwd()
+    if _spec is None:
+        _build_spec()
+    matcher = _matcher
+    root_rel = _relative_root(path, base)
+    if root_rel is None:
+        return None
+    prefix = ""
+    for part in root_rel.split("/") if root_rel else ():
+        # subpasta já ignorada pelas de cima: aparece vazia, como no walker
+        prefix = f"{prefix}/{part}" if prefix else part
+        if matcher.match(prefix) or matcher.prunes(prefix):
+            return iter([(path, [])])
+    files = git_list_files(path)
+    if files is None:
+        return None
+
+    def full_rel(rel):
+        return f"{root_rel}/{rel}" if root_rel else rel
+
+    def ignored(parent, rel):
+        # as pastas de cima já passaram: basta o nome (como no walker)
+        return matcher.match_entry(full_rel(parent) if parent else root_rel, rel.rpartition("/")[2])
+
+    def full(rel):
+        return os.path.join(path, *rel.split("/")) if rel else path
+
+    children = {"": []}   # pasta relativa -> [(rel, é_pasta)]
+    states = {"": "ok"}   # ok | pruned (aparece vazia) | ignored
+    kept = 0
+
+    def add_dir(parent, rel):
+        if states[parent] != "ok" or ignored(parent, rel):
+            states[rel] = "ignored"
+            return
+        states[rel] = "pruned" if matcher.prunes(full_rel(rel)) else "ok"
+        children[parent].append((rel, True))
+        children[rel] = []
+
+    for rel, is_dir in files:
+        parent = rel.rpartition("/")[0]
+        if parent not in states:
+            # cria as pastas do caminho que ainda não apareceram
+            missing, d = [], parent
+            while d not in states:
+                missing.append(d)
+                d = d.rpartition("/")[0]
+            for d in reversed(missing):
+                add_dir(d.rpartition("/")[0], d)
+        if states[parent] != "ok":
+            continue
+        if is_dir:
+            if rel not in states:
+                add_dir(parent, rel)
+        elif not ignored(parent, rel):
+            children[parent].append((rel, False))
+            kept += 1
+    if sizes is not None:
+        # o git não dá tamanhos dos não rastreados: lstat só nos que ficaram
+        for entries in children.values():
+            for rel, is_dir in entries:
+                if not is_dir:
+                    try:
+                        sizes[full(rel)] = os.lstat(full(rel)).st_size
+                    except OSError:
+                        pass
+    metrics.count("entries_scanned", len(files))
+    metrics.count("entries_ignored", len(files) - kept)
+
+    def batches():
+        stack = [""]
+        while stack:
+            if cancel is not None and cancel.is_set():
+                return
+            rel = stack.pop()
+            entries = children.get(rel, [])
+            yield full(rel), [(full(c), is_dir) for c, is_dir in entries]
+            stack.extend(reversed([c for c, is_dir in entries if is_dir]))
+    return batches()
+
+def scan_tree(path, cancel=None, workers=None, sizes=None):
+    # fonte da varredura: a lista do git quando ligada e houver repositório, senão o disco
+    forget_local_layers()  # varredura nova confere os .gitignore de novo
+    if USE_GIT_INDEX:
+        batches = walk_git(path, cancel, sizes)
+        if batches is not None:
+            return batches
+    return walk_directory(path, cancel=cancel, workers=workers, sizes=sizes)
+
+def merge_batch(nodes, current, entries):
+    # encaixa um lote do walk_directory na estrutura aninhada ({caminho: dict | None})
+    node = nodes.pop(current, None)
+    if node is None:
+        return
+    for full, is_dir in entries:
+        if is_dir:
+            node[full] = nodes[full] = {}
+        else:
+            node[full] = None
+
+def get_directory_structure(path, workers=None, sizes=None):
+    structure = {}
+    nodes = {path: structure}
+    with metrics.span("scan", root=path):
+        for current, entries in scan_tree(path, workers=workers, sizes=sizes):
+            merge_batch(nodes, current, entries)
     return structure
 
 
+def _sort_key(path):
+    return os.path.basename(path).lower()
+
+TREE_MAX_DEPTH = None   # níveis mostrados no mapa (None = todos)
+TREE_COLLAPSE = None    # pastas com mais filhos que isso viram "… (N arquivos)" (None = nunca)
+TREE_PAGE_LINES = 2000  # linhas inseridas por vez na janela do mapa
+
+def parse_limit(text):
+    # campo de número opcional: vazio -> None
+    text = (text or "").strip()
+    if not text:
+        return None
+    value = int(text)
+    if value <= 0:
+        raise ValueError(f"precisa ser maior que zero: {text}")
+    return value
+
+def tree_totals(structure, root_path, sizes=None):
+    # {pasta: (arquivos, bytes)} da subárvore inteira, numa passada pós-ordem
+    # que só guarda as pastas (os bytes vêm do stat da varredura, em "sizes")
+    totals = {}
+    stack = [(root_path, structure, False)]
+    while stack:
+        path, node, done = stack.pop()
+        if not done:
+            stack.append((path, node, True))
+            stack.extend((child, sub, False) for child, sub in node.items() if sub is not None)
+            continue
+        files = size = 0
+        for child, sub in node.items():
+            if sub is None:
+                files += 1
+                size += sizes.get(child, 0) if sizes else 0
+            else:
+                files += totals[child][0]
+                size += totals[child][1]
+        totals[path] = (files, size)
+    return totals
+
+def iter_tree_lines(structure, root_path, max_depth=None, collapse=None, totals=None, sizes=False):
+    # árvore em texto (├── / └──), uma linha por vez, sem montar a lista inteira.
+    # max_depth: abaixo disso só "… (N itens)"; collapse: pasta com mais filhos que isso
+    # vira "… (N arquivos)"; totals (tree_totals): "(N arquivos[, tamanho])" em cada pasta.
+    def label(path, is_dir):
+        name = os.path.basename(path)
+        if not is_dir:
+            return name
+        if totals is None:
+            return name + "/"
+        files, size = totals[path]
+        return f"{name}/ ({files} arquivos{', ' + format_bytes(size) if sizes else ''})"
+
+    def children(node):
+        return sorted(node.items(), key=lambda kv: _sort_key(kv[0]))
+
+    def summary(node):
+        files = sum(1 for sub in node.values() if sub is None)
+        dirs = len(node) - files
+        return f"… ({files} arquivos, {dirs} pastas)" if dirs else f"… ({files} arquivos)"
+
+    yield label(root_path, True) if totals is not None else os.path.basename(root_path) + "/"
+    # pilha de (filhos ordenados, próximo índice, prefixo, profundidade): só o caminho atual fica em memória
+    stack = [(children(structure), 0, "", 1)]
+    while stack:
+        items, i, prefix, depth = stack.pop()
+        if i >= len(items):
+            continue
+        stack.append((items, i + 1, prefix, depth))
+        path, sub = items[i]
+        last = i == len(items) - 1
+        if sub is None:
+            yield prefix + ("└── " if last else "├── ") + os.path.basename(path)
+            continue
+        yield prefix + ("└── " if last else "├── ") + label(path, True)
+        if not sub:
+            continue
+        inner = prefix + ("    " if last else "│   ")
+        if max_depth is not None and depth >= max_depth:
+            if totals is None:
+                yield f"{inner}└── … ({len(sub)} itens)"
+        elif collapse is not None and len(sub) > collapse:
+            yield f"{inner}└── {summary(sub)}"
+        else:
+            stack.append((children(sub), 0, inner, depth + 1))
+
+def write_tree(out, structure, root_path, **options):
+    # manda as linhas para um stream (arquivo, stdout, StringIO) em blocos
+    lines = iter_tree_lines(structure, root_path, **options)
+    out.write(next(lines))
+    while True:
+        chunk = list(islice(lines, TREE_PAGE_LINES))
+        if not chunk:
+            break
+        out.write("\n" + "\n".join(chunk))
+
+def render_tree(structure, root_path, **options):
+    buf = io.StringIO()
+    write_tree(buf, structure, root_path, **options)
+    return buf.getvalue()
+
+def iter_structure_files(structure):
+    # arquivos na ordem de exibição: os da pasta (por nome), depois as subpastas
+    stack = [structure]
+    while stack:
+        node = stack.pop()
+        files = [p for p, sub in node.items() if sub is None]
+        folders = [p for p, sub in node.items() if sub is not None]
+        yield from sorted(files, key=_sort_key)
+        stack.extend(node[p] for p in sorted(folders, key=_sort_key, reverse=True))
+
+SCAN_POLL_MS = 50        # intervalo entre drenagens da fila no loop do Tk
+SCAN_DRAIN_BUDGET = 0.03  # segundos gastos por drenagem, para a janela não travar
+
+class ScanWorker(threading.Thread):
+    # Varre a pasta numa thread e publica os lotes numa fila drenada com after().
+    # Com um snapshot (ver save_snapshot) publica primeiro a árvore da última sessão
+    # ("checked", "batch"... e "ready") e depois só as diferenças do disco, como
+    # eventos do modo observar: ("events", [("add"|"remove"|"size"|"batch", ...)]).
+    def __init__(self, path, snapshot=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.snapshot = snapshot
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.dirs = 0
+        self.files = 0
+        self.sizes = {}  # arquivo -> bytes, da listagem (do cache, pode estar velho)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            with metrics.profile("scan"), metrics.span("scan", root=self.path):
+                known = self._replay() if self.snapshot is not None else None
+                if known is None:
+                    for current, entries in scan_tree(self.path, cancel=self.cancelled, sizes=self.sizes):
+                        self.dirs += 1
+                        self.files += sum(1 for _, is_dir in entries if not is_dir)
+                        self.queue.put(("batch", current, entries))
+                else:
+                    self._revalidate(*known)
+        except Exception as e:
+            self.queue.put(("error", e))
+        self.queue.put(("done", None))
+
+    def _replay(self):
+        # publica a árvore salva; devolve ({pasta: {filho: é_pasta}}, {arquivo: bytes})
+        try:
+            lines = zlib.decompress(self.snapshot).decode("utf-8").split("\n")
+            header = json.loads(lines[0])
+        except (zlib.error, ValueError):
+            return None
+        if header.get("version") != SNAPSHOT_VERSION or header.get("root") != self.path:
+            return None
+        root = self.path
+        self.queue.put(("checked", {os.path.join(root, p) for p in header["checked"]}))
+        known, old_sizes = {}, {}
+        for line in lines[1:]:
+            if self.cancelled.is_set():
+                return None
+            rel, children = json.loads(line)
+            folder = os.path.join(root, rel) if rel else root
+            entries = []
+            for name, is_dir, size in children:
+                full = os.path.join(folder, name)
+                entries.append((full, bool(is_dir)))
+                if not is_dir:
+                    old_sizes[full] = self.sizes[full] = size
+            known[folder] = dict(entries)
+            self.queue.put(("batch", folder, entries))
+        self.queue.put(("ready", None))
+        return known, old_sizes
+
+    def _revalidate(self, known, old_sizes):
+        # varre o disco (pastas sem mudança de mtime saem do scan_cache.db) e manda só a diferença
+        for current, entries in scan_tree(self.path, cancel=self.cancelled, sizes=self.sizes):
+            self.dirs += 1
+            self.files += sum(1 for _, is_dir in entries if not is_dir)
+            old = known.pop(current, None)
+            if old is None:
+                # pasta nova (anunciada pelo "add" da pasta de cima) ou que não estava no snapshot
+                self.queue.put(("events", [("batch", current, entries)]))
+                continue
+            new = dict(entries)
+            events = [("remove", path) for path, is_dir in old.items() if new.get(path) != is_dir]
+            for path, is_dir in entries:
+                if old.get(path) != is_dir:
+                    events.append(("add", current, path, is_dir, self.sizes.get(path, 0)))
+                elif not is_dir and self.sizes.get(path, 0) != old_sizes.get(path, 0):
+                    events.append(("size", path, self.sizes.get(path, 0)))
+            if events:
+                self.queue.put(("events", events))
+
+
+# -- snapshot da última sessão: a janela abre com a árvore salva e revalida em segundo plano --
+STARTUP_SNAPSHOT = True
+SNAPSHOT_VERSION = 1
+
+def save_snapshot(view, db_path=None):
+    # guarda a árvore já varrida (em ordem de exibição), os tamanhos e o que está marcado.
+    # Uma linha JSON por pasta, comprimidas juntas; só a pasta aberta por último fica salva.
+    root = view.root_path
+    checked = set(view.selection_to_save())
+    lines = [json.dumps({"version": SNAPSHOT_VERSION, "root": root,
+                         "checked": [_relative_to(root, p) for p in checked]}, ensure_ascii=False)]
+    for folder, node in view.nodes.items():
+        if folder not in view.scanned:
+            continue
+        children = [[os.path.basename(p), 0 if sub is None else 1, view.sizes.get(p, 0) if sub is None else 0]
+                    for p, sub in node.items()]
+        lines.append(json.dumps([_relative_to(root, folder) if folder != root else "", children],
+                                ensure_ascii=False, separators=(",", ":")))
+    data = zlib.compress("\n".join(lines).encode("utf-8"), 1)
+    db = sqlite3.connect(db_path or SCAN_CACHE_FILE, timeout=5)
+    try:
+        with db:
+            db.execute("CREATE TABLE IF NOT EXISTS snapshot ("
+                       " root TEXT PRIMARY KEY, saved_at INTEGER NOT NULL, data BLOB NOT NULL)")
+            db.execute("DELETE FROM snapshot")
+            db.execute("INSERT INTO snapshot (root, saved_at, data) VALUES (?, ?, ?)",
+                       (root, int(time.time()), data))
+    finally:
+        db.close()
+
+def load_snapshot(root, db_path=None):
+    # bytes do snapshot da pasta (descomprimidos só na thread do ScanWorker), ou None
+    if not STARTUP_SNAPSHOT or not SCAN_CACHE_ENABLED:
+        return None
+    db = sqlite3.connect(db_path or SCAN_CACHE_FILE, timeout=5)
+    try:
+        row = db.execute("SELECT data FROM snapshot WHERE root = ?", (root,)).fetchone()
+    except sqlite3.OperationalError:
+        return None  # tabela ainda não existe
+    finally:
+        db.close()
+    return row[0] if row else None
+
+
+# -- modo observar: mudanças no disco chegam como eventos na fila --
+WATCH_POLL_MS = 100          # drenagem da fila de eventos no loop do Tk
+WATCH_DEBOUNCE_MS = 300      # espera a rajada acalmar antes de aplicar
+WATCH_MAX_DELAY_MS = 1500    # ...mas nunca segura os eventos mais do que isso
+WATCH_POLL_SECONDS = 2.0     # intervalo do fallback por stat
+
+class _Watcher(threading.Thread):
+    # Base dos observadores. Publica na fila:
+    #   ("add", pasta, caminho, é_pasta, bytes), ("batch", pasta, entradas) para o conteúdo
+    #   de pastas novas, ("size", caminho, bytes) quando um arquivo é regravado,
+    #   ("remove", caminho) e ("rescan", None) quando eventos se perderam.
+    def __init__(self, root, dirs):
+        super().__init__(daemon=True)
+        self.root = root
+        self.base = BASE_DIR or os.getcwd()
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.sizes = {}  # tamanhos dos arquivos das pastas novas (lido junto com os lotes)
+
+    def stop(self):
+        self.stopped.set()
+
+    def _track(self, folder, entries):
+        pass
+
+    def _untrack(self, folder):
+        pass
+
+    def _ignore_file(self, path):
+        # .gitignore/.ignore mexido: should_ignore volta a ler as camadas
+        if os.path.basename(path) in LOCAL_IGNORE_FILES:
+            forget_local_layers()
+
+    def _created(self, parent, path, is_dir):
+        self._ignore_file(path)
+        if should_ignore(path, self.base):
+            return
+        self.queue.put(("add", parent, path, is_dir, 0 if is_dir else _file_size(path)))
+        if is_dir:
+            # pasta nova (ou movida para cá) pode já chegar com conteúdo
+            try:
+                for current, entries in walk_directory(path, cancel=self.stopped, use_cache=False,
+                                                       sizes=self.sizes):
+                    self._track(current, entries)
+                    self.queue.put(("batch", current, entries))
+            except OSError:
+                # apagada antes de ser listada: o "remove" vem em seguida; senão, revarre
+                if os.path.isdir(path):
+                    self.queue.put(("rescan", None))
+
+    def _deleted(self, path, is_dir):
+        self._ignore_file(path)
+        if is_dir:
+            self._untrack(path)
+        self.queue.put(("remove", path))
+
+    def _modified(self, path):
+        self._ignore_file(path)
+        self.queue.put(("size", path, _file_size(path)))
+
+
+def _file_size(path):
+    try:
+        return os.lstat(path).st_size
+    except OSError:
+        return 0
+
+
+class PollingWatcher(_Watcher):
+    # Fallback portátil: relista só as pastas cujo mtime mudou
+    def __init__(self, root, dirs, interval=WATCH_POLL_SECONDS):
+        super().__init__(root, dirs)
+        self.interval = interval
+        self.known = {}   # pasta -> {filho: é_pasta}
+        self.mtimes = {}
+        for folder, entries in dirs.items():
+            self._track(folder, entries)
+
+    def _track(self, folder, entries):
+        self.known[folder] = dict(entries)
+        try:
+            self.mtimes[folder] = os.stat(folder).st_mtime_ns
+        except OSError:
+            self.mtimes[folder] = None
+
+    def _untrack(self, folder):
+        prefix = folder + os.sep
+        for d in [d for d in self.known if d == folder or d.startswith(prefix)]:
+            del self.known[d]
+            self.mtimes.pop(d, None)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for folder in list(self.known):
+                if self.stopped.is_set():
+                    return
+                if folder not in self.known:
+                    continue  # removida neste mesmo passo
+                try:
+                    mtime_ns = os.stat(folder).st_mtime_ns
+                except OSError:
+                    continue  # sumiu: o evento vem pela pasta de cima
+                if mtime_ns == self.mtimes.get(folder):
+                    continue
+                self.mtimes[folder] = mtime_ns
+                try:
+                    self._poll_folder(folder)
+                except Exception:
+                    # um evento ruim não pode matar o observador: a árvore é revarrida
+                    self.queue.put(("rescan", None))
+
+    def _poll_folder(self, folder):
+        # relista uma pasta que mudou e publica o que entrou/saiu
+        try:
+            listing = list_directory(folder)
+        except OSError:
+            return
+        old = self.known[folder]
+        new = {}
+        for name, is_dir, _size in listing:
+            full = os.path.join(folder, name)
+            if full in old and old[full] == is_dir:
+                new[full] = is_dir
+            elif not should_ignore(full, self.base):
+                new[full] = is_dir
+        for path, is_dir in old.items():
+            if new.get(path) != is_dir:
+                self._deleted(path, is_dir)
+        self.known[folder] = new
+        for path, is_dir in new.items():
+            if old.get(path) != is_dir:
+                self._created(folder, path, is_dir)
+
+
+_IN_CLOSE_WRITE = 0x08
+_IN_MOVED_FROM, _IN_MOVED_TO, _IN_CREATE, _IN_DELETE = 0x40, 0x80, 0x100, 0x200
+_IN_DELETE_SELF, _IN_MOVE_SELF, _IN_Q_OVERFLOW, _IN_IGNORED = 0x400, 0x800, 0x4000, 0x8000
+_IN_ONLYDIR, _IN_ISDIR = 0x01000000, 0x40000000
+_IN_CLOEXEC, _IN_NONBLOCK = 0o2000000, 0o4000
+_INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (+ nome)
+
+class InotifyWatcher(_Watcher):
+    # Linux: inotify direto da libc via ctypes, um watch por pasta da árvore
+    MASK = (_IN_CLOSE_WRITE | _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO
+            | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+
+    def __init__(self, root, dirs):
+        super().__init__(root, dirs)
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(_IN_CLOEXEC | _IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.get_errno = ctypes.get_errno
+        self.wds = {}    # wd -> pasta
+        self.paths = {}  # pasta -> wd
+        try:
+            for folder in dirs:
+                self._add_watch(folder)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add_watch(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK)
+        if wd < 0:
+            errno = self.get_errno()
+            if errno == 28:  # ENOSPC: limite max_user_watches
+                raise OSError(errno, "inotify: limite de watches atingido")
+            return  # pasta sumiu no meio do caminho
+        self.wds[wd] = folder
+        self.paths[folder] = wd
+
+    def _track(self, folder, entries):
+        if folder not in self.paths:
+            try:
+                self._add_watch(folder)
+            except OSError:
+                self.queue.put(("rescan", None))
+
+    def _untrack(self, folder):
+        prefix = folder + os.sep
+        for d in [d for d in self.paths if d == folder or d.startswith(prefix)]:
+            wd = self.paths.pop(d)
+            self.wds.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def run(self):
+        import select
+        try:
+            while not self.stopped.is_set():
+                ready, _, _ = select.select([self.fd], [], [], 0.5)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                try:
+                    self._dispatch(data)
+                except Exception:
+                    # um evento ruim não pode matar o observador: a árvore é revarrida
+                    self.queue.put(("rescan", None))
+        finally:
+            os.close(self.fd)
+
+    def _dispatch(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                self.queue.put(("rescan", None))
+                continue
+            if mask & _IN_IGNORED:
+                folder = self.wds.pop(wd, None)
+                if folder is not None and self.paths.get(folder) == wd:
+                    del self.paths[folder]
+                continue
+            folder = self.wds.get(wd)
+            if folder is None or not name:
+                continue  # *_SELF: tratado pelo evento da pasta de cima
+            path = os.path.join(folder, name)
+            is_dir = bool(mask & _IN_ISDIR)
+            # renomear = sai do nome antigo (MOVED_FROM) e entra no novo (MOVED_TO)
+            if mask & (_IN_DELETE | _IN_MOVED_FROM):
+                self._deleted(path, is_dir)
+            elif mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._created(folder, path, is_dir)
+            elif mask & _IN_CLOSE_WRITE and not is_dir:
+                self._modified(path)
+
+
+def create_watcher(root, dirs):
+    # inotify quando disponível; senão (Windows/macOS/limite de watches) polling
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root, dirs)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root, dirs)
+
+
+EXPORT_FILE = "output.txt"
+EXPORT_WORKERS = 8       # leituras simultâneas no pool
+EXPORT_READ_AHEAD = 4    # blocos em espera por worker (limita a memória)
+
+SNIFF_BYTES = 8192                      # cabeça lida para detectar binário/encoding
+EXPORT_MAX_FILE_BYTES = 2 * 1024 * 1024  # teto por arquivo (None = sem limite)
+FALLBACK_ENCODING = "cp1252"            # quando não é UTF-8 válido
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+def sniff_encoding(head, complete=True):
+    # decide pelo começo do arquivo: encoding a usar, ou None se for binário
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    if b"\0" in head:
+        return None
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # cabeça cortada no meio de um caractere multibyte ainda é UTF-8
+        if complete or e.start < len(head) - 3:
+            return FALLBACK_ENCODING
+    return "utf-8"
+
+def _read_block(path, max_bytes=None):
+    # bloco "=== caminho ===" de um arquivo, ou (None, motivo) quando fica de fora
+    text, reason = _read_text(path, max_bytes)
+    if text is None:
+        return None, reason
+    return f"=== {path} ===\n" + text + "\n\n", None
+
+def _read_text(path, max_bytes=None):
+    # conteúdo decodificado (até o teto), ou (None, motivo)
+    if max_bytes is None:
+        max_bytes = EXPORT_MAX_FILE_BYTES
+    if not os.path.isfile(path):
+        return None, "não é arquivo"
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(SNIFF_BYTES)
+        encoding = sniff_encoding(head, complete=len(head) < SNIFF_BYTES)
+        if encoding is None:
+            return None, "binário"
+        limit = size if not max_bytes else min(size, max_bytes)
+        # só lê até o teto: um log de GB marcado por engano não vai inteiro pra RAM
+        data = head + f.read(max(limit - len(head), 0)) if limit > len(head) else head[:limit]
+    metrics.count("bytes_read", len(data))
+    truncated = size - len(data) if size > len(data) else 0
+    try:
+        text = codecs.getincrementaldecoder(encoding)().decode(data, final=not truncated)
+    except UnicodeDecodeError:
+        # UTF-8 inválido depois da cabeça: transcodifica
+        text = data.decode(FALLBACK_ENCODING, errors="replace")
+    # mesmas quebras de linha da leitura em modo texto
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if truncated:
+        text += f"\n[truncated {truncated} bytes]"
+    return text, None
+
+TOKEN_CHARS = 4  # caracteres por token, em média (estimativa sem tokenizer)
+
+def estimate_block_size(path, size):
+    # tamanho do bloco no output só a partir do stat (sem abrir o arquivo)
+    if EXPORT_MAX_FILE_BYTES:
+        size = min(size, EXPORT_MAX_FILE_BYTES)
+    return size + len(path) + 10  # "=== caminho ===\n" + "\n\n"
+
+def estimate_tokens(chars):
+    return (chars + TOKEN_CHARS - 1) // TOKEN_CHARS
+
+def parse_budget(text):
+    # "120000", "120k", "1.5m" -> tokens; vazio -> None (sem orçamento)
+    text = (text or "").strip().lower().replace("_", "")
+    if not text:
+        return None
+    scale = {"k": 1000, "m": 1000000}.get(text[-1], 1)
+    value = int(float(text[:-1] if scale > 1 else text) * scale)
+    if value <= 0:
+        raise ValueError(f"orçamento inválido: {text}")
+    return value
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+EXPORT_CACHE_MAX_ENTRIES = 20000  # blocos mantidos no cache (os usados há mais tempo saem)
+
+def block_digest(block):
+    return hashlib.blake2b(block.encode("utf-8", "replace"), digest_size=16).hexdigest()
+
+class ExportCache(object):
+    # Cache dos blocos "=== caminho ===" já formatados, no mesmo scan_cache.db,
+    # chaveado por (caminho, tamanho, mtime_ns, teto por arquivo). Cada bloco
+    # guarda um hash do conteúdo, usado pelo modo "só alterações".
+    # Os esboços (outline) ficam numa tabela própria, "outlines".
+    def __init__(self, db_path=None, table="blocks"):
+        self.table = table
+        self.db = sqlite3.connect(db_path or SCAN_CACHE_FILE, timeout=5)
+        self.db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " cap INTEGER NOT NULL, digest TEXT NOT NULL, block TEXT NOT NULL,"
+            " used_at INTEGER NOT NULL)"
+        )
+        self.now = time.time_ns()
+        self.stored = []
+        self.used = []
+
+    def get(self, path, st, cap):
+        row = self.db.execute(
+            f"SELECT block, digest FROM {self.table} WHERE path = ? AND size = ? AND mtime_ns = ? AND cap = ?",
+            (path, st.st_size, st.st_mtime_ns, cap or 0)).fetchone()
+        if row is not None:
+            self.used.append((self.now, path))
+        return row
+
+    def put(self, path, st, cap, block, digest):
+        # arquivo alterado agora há pouco: o mtime não é confiável, não guarda
+        if self.now - st.st_mtime_ns < SCAN_CACHE_RACY_NS:
+            return
+        self.stored.append((path, st.st_size, st.st_mtime_ns, cap or 0, digest, block, self.now))
+
+    def close(self):
+        with self.db:
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (path, size, mtime_ns, cap, digest, block, used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)", self.stored)
+            self.db.executemany(f"UPDATE {self.table} SET used_at = ? WHERE path = ?", self.used)
+            self.db.execute(
+                f"DELETE FROM {self.table} WHERE path NOT IN"
+                f" (SELECT path FROM {self.table} ORDER BY used_at DESC LIMIT ?)", (EXPORT_CACHE_MAX_ENTRIES,))
+        self.db.close()
+
+def _read_hashed(path):
+    start = time.perf_counter()
+    block, reason = _read_block(path)
+    digest = block_digest(block) if block is not None else None
+    # soma do tempo das threads do pool, não o tempo de parede
+    metrics.add("export_read", time.perf_counter() - start)
+    return block, reason, digest
+
+# -- esboço (outline): só classes, funções e assinaturas, sem os corpos --
+OUTLINE_LANGUAGES = {
+    ".py": "python", ".pyw": "python",
+    ".js": "braces", ".jsx": "braces", ".mjs": "braces", ".cjs": "braces",
+    ".ts": "braces", ".tsx": "braces", ".mts": "braces", ".cts": "braces",
+    ".php": "php", ".java": "braces", ".cs": "braces", ".kt": "braces",
+}
+OUTLINE_WORKERS = None  # processos do pool (None = um por CPU)
+OUTLINE_INLINE = 4      # os primeiros arquivos são feitos nas threads: abrir processos custa mais
+OUTLINE_LINE_MAX = 160  # linhas de declaração mais longas são cortadas com "…"
+
+def outline_language(path):
+    return OUTLINE_LANGUAGES.get(os.path.splitext(path)[1].lower())
+
+def _clip(line):
+    return line if len(line) <= OUTLINE_LINE_MAX else line[:OUTLINE_LINE_MAX - 1] + "…"
+
+def _outline_python(text):
+    import ast
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None  # não compila (ou veio truncado): vai o conteúdo inteiro
+    lines = text.splitlines()
+    out = []
+
+    def first_line(node):
+        line = lines[node.lineno - 1]
+        if getattr(node, "end_lineno", node.lineno) > node.lineno:
+            line += " …"
+        out.append(_clip(line.rstrip()))
+
+    def header(node):
+        # decoradores + "def ...:" como estão no fonte (assinaturas de várias linhas inclusive)
+        start = min([d.lineno for d in node.decorator_list] + [node.lineno]) - 1
+        body = node.body[0]
+        if body.lineno > node.lineno:
+            chunk = lines[start:body.lineno - 1]
+            while chunk and (not chunk[-1].strip() or chunk[-1].lstrip().startswith("#")):
+                chunk.pop()
+            indent = " " * body.col_offset
+        else:
+            # "def f(): return 1" numa linha só
+            chunk = lines[start:node.lineno - 1] + [lines[node.lineno - 1][:body.col_offset].rstrip()]
+            indent = " " * (node.col_offset + 4)
+        out.extend(line.rstrip() for line in chunk)
+        doc = ast.get_docstring(node)
+        if doc and doc.strip():
+            out.append(_clip(f'{indent}"""{doc.strip().splitlines()[0]}"""'))
+        return indent
+
+    def visit(nodes):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                out.append(header(node) + "...")
+            elif isinstance(node, ast.ClassDef):
+                indent = header(node)
+                size = len(out)
+                visit(node.body)
+                if len(out) == size:
+                    out.append(indent + "...")
+            elif isinstance(node, (ast.Import, ast.ImportFrom, ast.Assign, ast.AnnAssign)):
+                first_line(node)
+
+    visit(tree.body)
+    return "\n".join(out)
+
+
+_BRACE_TOKENS = r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/{hash})
+   |(?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`)
+   |(?P<nl>\n)
+   |(?P<open>[{{(\[])
+   |(?P<close>[}})\]])
+   |(?P<semi>;)
+   |(?P<other>[^\n{{}}()\[\];"'`/#]+|[/#])
+"""
+_BRACE_RE = re.compile(_BRACE_TOKENS.format(hash=""), re.S | re.X)
+_BRACE_RE_PHP = re.compile(_BRACE_TOKENS.format(hash=r"|\#[^\n]*"), re.S | re.X)
+_CONTROL = re.compile(r"^(?:}\s*)?(?:if|else|for|foreach|while|do|switch|try|catch|finally|with|"
+                      r"synchronized|using|lock|return|new)\b")
+_CLASS_LIKE = re.compile(r"^(?:[\w@]+\s+)*?(?:class|interface|trait|enum|namespace|module|record|object)\b[^=(]*$")
+_FUNCTION_LIKE = re.compile(r"\bfunction\b|=>|\)[^()=]*$")
+_VALUE_BRACE = re.compile(r"(?:[=:,(?]|\b(?:return|const|let|var)|^(?:import|export)(?:\s+(?:default|type))?)$")
+_REGEX_LITERAL = re.compile(r"(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[a-z]*")
+_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^") | {""}  # "/" depois disso abre um regex, não é divisão
+_TOP_LEVEL = re.compile(r"^(?:import|export|use|namespace|package|require|declare|using|from)\b|\brequire\(|^module\.exports\b")
+_CONTINUES = re.compile(r"^(?:extends|implements|throws|where)\b|^[.,:?&|=>+\-*/]")
+
+def _logical_lines(segments):
+    # junta as linhas físicas que continuam a anterior (extends/implements, operadores...)
+    lines = []
+    for seg in segments:
+        seg = " ".join(seg.split())
+        if not seg:
+            continue
+        if lines and (_CONTINUES.match(seg) or lines[-1][-1] in ",=(:?&|+-*/"):
+            lines[-1] += " " + seg
+        else:
+            lines.append(seg)
+    return lines
+
+def _outline_braces(text, php=False):
+    # Tokenizador leve para linguagens de chaves (JS/TS, PHP, Java, C#):
+    # mantém o corpo de classes/interfaces/namespaces e troca o de funções por "{ … }".
+    out = []
+    frames = []     # corpos mantidos abertos: "class" ou "top" (namespace/módulo)
+    skip = 0        # profundidade dentro de um corpo pulado
+    nest = 0        # ( [ { abertos dentro do cabeçalho atual
+    segments = [""]
+    tokens = _BRACE_RE_PHP if php else _BRACE_RE
+    pos, prev = 0, ""
+
+    def flush():
+        kind = frames[-1] if frames else "top"
+        indent = "    " * len(frames)
+        for line in _logical_lines(segments):
+            if kind == "class" or _TOP_LEVEL.search(line):
+                out.append(_clip(indent + line + (";" if php else "")))
+        segments[:] = [""]
+
+    while pos < len(text):
+        m = tokens.match(text, pos)
+        if m is None:
+            pos += 1  # aspas sem par: segue adiante
+            continue
+        pos = m.end()
+        kind, tok = m.lastgroup, m.group()
+        if tok == "/" and prev in _REGEX_AFTER:
+            literal = _REGEX_LITERAL.match(text, pos)
+            if literal is not None:
+                kind, tok, pos = "string", text[m.start():literal.end()], literal.end()
+        if kind == "comment":
+            continue
+        if kind != "nl" and tok.strip():
+            prev = tok.rstrip()[-1]
+        if skip:
+            if tok == "{":
+                skip += 1
+            elif tok == "}":
+                skip -= 1
+            continue
+        if kind == "nl":
+            if nest:
+                segments[-1] += " "
+            else:
+                segments.append("")
+            continue
+        if nest:
+            segments[-1] += tok
+            if kind == "open":
+                nest += 1
+            elif kind == "close":
+                nest -= 1
+            continue
+        if tok in "([" or tok == "{" and _VALUE_BRACE.search(" ".join(segments[-1].split())):
+            # parênteses, colchetes e objetos literais ("= {", "import {") ficam no texto da linha
+            nest += 1
+            segments[-1] += tok
+        elif tok == "{":
+            lines = _logical_lines(segments)
+            header = lines.pop() if lines else ""
+            segments[:] = lines
+            flush()
+            indent = "    " * len(frames)
+            if header and not _CONTROL.match(header) and _CLASS_LIKE.match(header):
+                out.append(_clip(indent + header + " {"))
+                frames.append("top" if re.search(r"\b(?:namespace|module)\b", header) else "class")
+            else:
+                if header and not _CONTROL.match(header) and _FUNCTION_LIKE.search(header):
+                    out.append(_clip(indent + header + " { … }"))
+                skip = 1
+        elif tok == "}":
+            flush()
+            if frames:
+                frames.pop()
+                out.append("    " * len(frames) + "}")
+        elif kind == "semi":
+            flush()
+        else:
+            segments[-1] += tok
+    flush()
+    return "\n".join(out)
+
+def outline_text(text, language):
+    if language == "python":
+        return _outline_python(text)
+    return _outline_braces(text, php=language == "php")
+
+def _outline_hashed(path, max_bytes=None):
+    # roda nos processos do pool: lê, extrai o esboço e devolve (bloco, motivo, hash).
+    # Sem nada para resumir (ou sem compilar) vai o arquivo inteiro.
+    text, reason = _read_text(path, max_bytes)
+    if text is None:
+        return None, reason, None
+    outline = outline_text(text, outline_language(path))
+    if outline and outline.strip():
+        block = f"=== {path} === (esboço)\n" + outline + "\n\n"
+    else:
+        block = f"=== {path} ===\n" + text + "\n\n"
+    return block, None, block_digest(block)
+
+def iter_export_blocks(paths, workers=EXPORT_WORKERS, cache=None, outline=None, outline_cache=None,
+                       duplicates=None):
+    # lê os arquivos num pool limitado, devolvendo (caminho, bloco, motivo, hash)
+    # na ordem original; o que está no cache nem chega a ser lido.
+    # outline: True (todos) ou o conjunto de caminhos que saem como esboço; o parsing
+    # roda num pool de processos (ast/tokenizador seguram o GIL) e tem cache próprio.
+    # duplicates ({cópia: (original, hash)}): as cópias não são lidas, viram referência.
+    cap = EXPORT_MAX_FILE_BYTES
+    procs = None
+    inline = 0
+
+    def submit(pool, path):
+        nonlocal procs, inline
+        if duplicates and path in duplicates:
+            original, digest = duplicates[path]
+            return path, None, None, (f"=== {path} === (idêntico a {original})\n\n", "=" + digest), None
+        as_outline = bool(outline) and (outline is True or path in outline) \
+            and outline_language(path) is not None
+        store = outline_cache if as_outline else cache
+        st = None
+        if store is not None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                pass
+            else:
+                hit = store.get(path, st, cap)
+                if hit is not None:
+                    return path, st, None, hit, store
+        if not as_outline:
+            future = pool.submit(_read_hashed, path)
+        elif inline < OUTLINE_INLINE:
+            inline += 1
+            future = pool.submit(_outline_hashed, path, cap)
+        else:
+            if procs is None:
+                # spawn: fork de um processo com threads (Tk, pool de leitura) não é seguro
+                import multiprocessing
+                procs = ProcessPoolExecutor(OUTLINE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            future = procs.submit(_outline_hashed, path, cap)
+        return path, st, future, None, store
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            it = iter(paths)
+            for path in islice(it, workers * EXPORT_READ_AHEAD):
+                pending.append(submit(pool, path))
+            while pending:
+                path, st, future, hit, store = pending.popleft()
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending.append(submit(pool, nxt))
+                if hit is not None:
+                    yield path, hit[0], None, hit[1]
+                    continue
+                try:
+                    try:
+                        block, reason, digest = future.result()
+                    except BrokenProcessPool:
+                        # sem processos (ex.: executável sem freeze_support): faz aqui mesmo
+                        block, reason, digest = _outline_hashed(path, cap)
+                except OSError as e:
+                    block, reason, digest = None, e.strerror or str(e), None
+                if block is not None and st is not None:
+                    store.put(path, st, cap, block, digest)
+                yield path, block, reason, digest
+    finally:
+        if procs is not None:
+            procs.shutdown()
+
+# -- arquivos idênticos: o segundo em diante vira só uma referência ao primeiro --
+EXPORT_DEDUPE = True                # padrão da caixa "Não repetir arquivos idênticos"
+DEDUPE_HEAD_BYTES = 64 * 1024       # primeira passada: só a cabeça de quem tem o mesmo tamanho
+DEDUPE_CHUNK_BYTES = 1024 * 1024    # leitura em pedaços (arquivos grandes não vão inteiros pra RAM)
+
+def _hash_file(path, limit=None):
+    # (hash dos primeiros "limit" bytes, leu até o fim do arquivo?)
+    digest = hashlib.blake2b(digest_size=16)
+    read = 0
+    complete = False
+    with open(path, "rb") as f:
+        while limit is None or read < limit:
+            chunk = f.read(DEDUPE_CHUNK_BYTES if limit is None else min(DEDUPE_CHUNK_BYTES, limit - read))
+            if not chunk:
+                complete = True
+                break
+            digest.update(chunk)
+            read += len(chunk)
+        else:
+            complete = not f.read(1)
+    metrics.count("bytes_hashed", read)
+    return digest.hexdigest(), complete
+
+def find_duplicates(paths, sizes=None, workers=EXPORT_WORKERS, cancel=None):
+    # Grupos de arquivos com o mesmo conteúdo, [(hash, [caminhos...])] na ordem de "paths".
+    # Só quem tem tamanho igual (do stat da varredura, em "sizes") é lido: primeiro a
+    # cabeça, e o arquivo inteiro só se a cabeça também empatar. O tamanho só agrupa:
+    # quem decide se a cabeça já foi o arquivo todo é a própria leitura (o arquivo
+    # pode ter crescido depois da varredura).
+    order, by_size = {}, {}
+    for i, path in enumerate(paths):
+        order[path] = i
+        size = sizes.get(path) if sizes else None
+        if size is None:
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+        if size:  # vazios são todos iguais, mas não gastam nada no export
+            by_size.setdefault(size, []).append(path)
+
+    def refine(groups, limit, pool):
+        # quebra cada grupo pelo (hash, chegou ao fim?) da cabeça ou do arquivo inteiro
+        jobs = [(size, [(p, pool.submit(_hash_file, p, limit)) for p in group]) for size, group in groups]
+        refined = []
+        for size, futures in jobs:
+            if cancel is not None and cancel.is_set():
+                for _, future in futures:
+                    future.cancel()
+                continue
+            buckets = {}
+            for path, future in futures:
+                try:
+                    buckets.setdefault(future.result(), []).append(path)
+                except OSError:
+                    pass
+            refined.extend((size, digest, group) for digest, group in buckets.items() if len(group) > 1)
+        return refined
+
+    with metrics.span("dedupe", files=len(order)), ThreadPoolExecutor(max_workers=workers) as pool:
+        candidates = [(size, group) for size, group in by_size.items() if len(group) > 1]
+        heads = refine(candidates, DEDUPE_HEAD_BYTES, pool)
+        # a cabeça leu até o fim: já é o hash do arquivo todo
+        groups = [(digest, group) for size, (digest, complete), group in heads if complete]
+        big = [(size, group) for size, (digest, complete), group in heads if not complete]
+        groups.extend((digest, group) for _, (digest, complete), group in refine(big, None, pool)
+                      if complete)
+    if cancel is not None and cancel.is_set():
+        return []
+    groups.sort(key=lambda g: order[g[1][0]])
+    return groups
+
+def duplicate_map(paths, sizes=None, cancel=None):
+    # {cópia: (primeiro do grupo, hash)} para o export
+    duplicates = {}
+    for digest, group in find_duplicates(paths, sizes, cancel=cancel):
+        for path in group[1:]:
+            duplicates[path] = (group[0], digest)
+    return duplicates
+
+class RestatWorker(threading.Thread):
+    # confere o tamanho dos arquivos marcados depois da varredura (a estimativa do rodapé)
+    def __init__(self, paths, sizes):
+        super().__init__(daemon=True)
+        self.paths = list(paths)
+        self.sizes = dict(sizes)
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            self.queue.put(("done", restat_sizes(self.paths, self.sizes, self.cancelled)))
+        except Exception as e:
+            self.queue.put(("error", e))
+
+class DuplicateWorker(threading.Thread):
+    # roda o find_duplicates fora do loop do Tk (para marcar os grupos na árvore)
+    def __init__(self, paths, sizes=None):
+        super().__init__(daemon=True)
+        self.paths = list(paths)
+        self.sizes = sizes
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            self.queue.put(("done", find_duplicates(self.paths, self.sizes, cancel=self.cancelled)))
+        except Exception as e:
+            self.queue.put(("error", e))
+
+BUDGET_REASON = "não coube no orçamento"
+
+def stream_export(paths, outputs, progress=None, cancel=None, previous=None, use_cache=True,
+                  budget=None, outline=None, duplicates=None):
+    # escreve cada bloco em todos os streams de saída, numa única passada.
+    # Com "previous" ({caminho: hash} do último export) só sai o que mudou,
+    # mais um aviso para cada arquivo que deixou de existir/ser selecionado.
+    # Com "budget" (caracteres) para no primeiro arquivo que estouraria o orçamento
+    # e devolve ele e os seguintes em skipped.
+    # Com "outline" (True ou conjunto de caminhos) o código sai só com as assinaturas,
+    # e com "duplicates" (ver duplicate_map) as cópias saem como referência ao original.
+    duplicates = duplicates or {}
+    failed = {}  # original que ficou de fora: as cópias dele também ficam
+    written, skipped, manifest = 0, [], {}
+    write_time = 0.0
+    used = 0
+    cache = ExportCache() if use_cache else None
+    outline_cache = ExportCache(table="outlines") if use_cache and outline else None
+    blocks = iter_export_blocks(paths, cache=cache, outline=outline, outline_cache=outline_cache,
+                                duplicates=duplicates)
+    try:
+        for done, (path, block, reason, digest) in enumerate(blocks, 1):
+            if cancel is not None and cancel.is_set():
+                break
+            if path in duplicates and duplicates[path][0] in failed:
+                block, reason = None, failed[duplicates[path][0]]
+            changed = block is not None and (previous is None or previous.get(path) != digest)
+            if changed and budget is not None and used + len(block) > budget:
+                skipped.extend((p, BUDGET_REASON) for p in list(paths)[done - 1:])
+                break
+            if block is None:
+                skipped.append((path, reason))
+                failed[path] = reason
+            else:
+                manifest[path] = digest
+                if changed:
+                    used += len(block)
+                    start = time.perf_counter()
+                    for out in outputs:
+                        out.write(block)
+                    write_time += time.perf_counter() - start
+                    written += 1
+            if progress is not None:
+                progress(done)
+        else:
+            for path in previous or ():
+                if path not in manifest:
+                    for out in outputs:
+                        out.write(f"=== {path} === (removido)\n\n")
+    finally:
+        blocks.close()
+        if cache is not None:
+            cache.close()
+        if outline_cache is not None:
+            outline_cache.close()
+        metrics.add("export_write", write_time, calls=written)
+    return written, skipped, manifest
+
+class ChunkedOutput(object):
+    # Stream de saída que divide o export em partes numeradas (output_001.txt, ...)
+    # de até "budget" caracteres, sempre entre um arquivo e outro. Cada write() é
+    # um bloco inteiro; um bloco maior que o orçamento vai sozinho numa parte.
+    def __init__(self, out_file, budget):
+        self.stem, self.ext = os.path.splitext(out_file)
+        self.budget = budget
+        self.parts = []      # [{"file", "chars", "files"}]
+        self.first = []      # texto da parte 1 (vai para o clipboard)
+        self._out = None
+        self._used = 0
+
+    def part_name(self, number):
+        return f"{self.stem}_{number:03d}{self.ext}"
+
+    def write(self, block):
+        if self._out is None or (self._used and self._used + len(block) > self.budget):
+            self._next()
+        self._out.write(block)
+        self._used += len(block)
+        part = self.parts[-1]
+        part["chars"] += len(block)
+        part["files"] += block.startswith("=== ")
+        if len(self.parts) == 1:
+            self.first.append(block)
+
+    def _next(self):
+        if self._out is not None:
+            self._out.close()
+        name = self.part_name(len(self.parts) + 1)
+        self._out = open(name, "w", encoding="utf-8")
+        self._used = 0
+        self.parts.append({"file": name, "chars": 0, "files": 0})
+
+    def text(self):
+        return "".join(self.first)
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        # partes que sobraram de um export anterior maior confundiriam quem for colar
+        number = len(self.parts) + 1
+        while os.path.exists(self.part_name(number)):
+            os.remove(self.part_name(number))
+            number += 1
+
+def export_files(paths, out_file=EXPORT_FILE, progress=None, cancel=None, previous=None,
+                 budget=None, split=False, outline=None, dedupe=False, sizes=None):
+    # grava o output.txt e monta o texto do clipboard sem reler o arquivo.
+    # budget (caracteres): com split, divide em partes numeradas e o clipboard
+    # recebe a parte 1; sem split, para quando o próximo arquivo não couber.
+    # dedupe: arquivos idênticos (pelo tamanho em "sizes" e depois hash) saem uma vez só.
+    with metrics.span("export", files=len(paths), delta=previous is not None):
+        duplicates = duplicate_map(paths, sizes, cancel) if dedupe else None
+        if budget is not None and split:
+            chunks = ChunkedOutput(out_file, budget)
+            try:
+                written, skipped, manifest = stream_export(paths, (chunks,), progress, cancel, previous,
+                                                           outline=outline, duplicates=duplicates)
+            finally:
+                chunks.close()
+            text, parts = chunks.text(), chunks.parts
+        else:
+            buf = io.StringIO()
+            with open(out_file, "w", encoding="utf-8") as out:
+                written, skipped, manifest = stream_export(paths, (out, buf), progress, cancel,
+                                                           previous, budget=budget, outline=outline,
+                                                           duplicates=duplicates)
+            text, parts = buf.getvalue(), None
+    removed = [p for p in previous or () if p not in manifest]
+    return {"text": text, "written": written, "skipped": skipped,
+            "manifest": manifest, "removed": removed, "parts": parts,
+            "duplicates": sum(1 for p in duplicates or () if p in manifest)}
+
+class ExportWorker(threading.Thread):
+    # roda o export_files fora do loop do Tk; o progresso fica em self.done
+    def __init__(self, paths, out_file=EXPORT_FILE, previous=None, budget=None, split=False, outline=None,
+                 dedupe=False, sizes=None):
+        super().__init__(daemon=True)
+        self.paths = list(paths)
+        self.out_file = out_file
+        self.previous = previous
+        self.budget = budget
+        self.split = split
+        self.outline = outline
+        self.dedupe = dedupe
+        self.sizes = sizes
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.done = 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _progress(self, done):
+        self.done = done
+
+    def run(self):
+        try:
+            with metrics.profile("export"):
+                result = export_files(self.paths, self.out_file, self._progress, self.cancelled,
+                                      self.previous, self.budget, self.split, self.outline,
+                                      self.dedupe, self.sizes)
+            self.queue.put(("done", result))
+        except Exception as e:
+            self.queue.put(("error", e))
+
+
+class _TrieNode(object):
+    __slots__ = ("path", "parent", "children", "selected", "total", "size", "selected_size")
+
+    def __init__(self, path, parent, is_dir, size=0):
+        self.path = path
+        self.parent = parent
+        self.children = {} if is_dir else None  # nome -> nó (None = arquivo)
+        self.selected = 0                       # arquivos marcados na subárvore
+        self.total = 0 if is_dir else 1         # arquivos na subárvore
+        self.size = size                        # bytes estimados na subárvore
+        self.selected_size = 0                  # ...e quanto disso está marcado
+
+class SelectionTrie(object):
+    # Seleção como trie de caminhos com contadores marcados/total por nó:
+    # o estado de uma pasta sai dos contadores e marcar uma subárvore só
+    # visita os nós que realmente mudam.
+    CHECKED, PARTIAL, UNCHECKED = "checked", "partial", "unchecked"
+
+    def __init__(self, root_path):
+        self.root = _TrieNode(root_path, None, True)
+        self.index = {root_path: self.root}
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def add(self, parent_path, path, is_dir, selected=False, size=0):
+        parent = self.index[parent_path]
+        node = _TrieNode(path, parent, is_dir, 0 if is_dir else size)
+        parent.children[os.path.basename(path)] = node
+        self.index[path] = node
+        if not is_dir:
+            node.selected = 1 if selected else 0
+            node.selected_size = node.size if selected else 0
+            self._propagate(parent, 1, node.selected, node.size, node.selected_size)
+        return node
+
+    def remove(self, path):
+        # tira o nó (e a subárvore) descontando os contadores das pastas de cima
+        node = self.index.pop(path, None)
+        if node is None or node.parent is None:
+            return
+        del node.parent.children[os.path.basename(path)]
+        self._propagate(node.parent, -node.total, -node.selected, -node.size, -node.selected_size)
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if n.children:
+                for child in n.children.values():
+                    self.index.pop(child.path, None)
+                    stack.append(child)
+
+    def resize(self, path, size):
+        # arquivo mudou de tamanho (modo observar)
+        node = self.index.get(path)
+        if node is None or node.children is not None or node.size == size:
+            return
+        d_size = size - node.size
+        d_selected = d_size if node.selected else 0
+        node.size = size
+        node.selected_size += d_selected
+        self._propagate(node.parent, 0, 0, d_size, d_selected)
+
+    def _propagate(self, node, d_total, d_selected, d_size=0, d_selected_size=0):
+        while node is not None:
+            node.total += d_total
+            node.selected += d_selected
+            node.size += d_size
+            node.selected_size += d_selected_size
+            node = node.parent
+
+    def state(self, path):
+        node = self.index[path]
+        if node.selected == 0:
+            return self.UNCHECKED
+        return self.CHECKED if node.selected == node.total else self.PARTIAL
+
+    def is_selected(self, path):
+        node = self.index.get(path)
+        return node is not None and node.children is None and node.selected == 1
+
+    def set(self, path, value):
+        # marca/desmarca um arquivo ou uma pasta inteira
+        node = self.index[path]
+        before, before_size = node.selected, node.selected_size
+        self._fill(node, value)
+        if node.selected != before:
+            self._propagate(node.parent, 0, node.selected - before, 0, node.selected_size - before_size)
+
+    def _fill(self, node, value):
+        target = (node.total if node.children is not None else 1) if value else 0
+        if node.selected == target:
+            return
+        if node.children is not None:
+            for child in node.children.values():
+                self._fill(child, value)
+        node.selected = target
+        node.selected_size = node.size if value else 0
+
+    def totals(self, path=None):
+        # (arquivos marcados, bytes estimados marcados)
+        node = self.index[path or self.root.path]
+        return node.selected, node.selected_size
+
+    def toggle(self, path):
+        self.set(path, self.state(path) != self.CHECKED)
+
+    def select_all(self):
+        self.set(self.root.path, True)
+
+    def clear(self):
+        self.set(self.root.path, False)
+
+    def iter_selected(self, path=None):
+        # arquivos marcados na ordem de exibição, sem descer onde não há nada marcado
+        stack = [self.index[path or self.root.path]]
+        while stack:
+            node = stack.pop()
+            if node.children is None:
+                if node.selected:
+                    yield node.path
+                continue
+            kids = [c for c in node.children.values() if c.selected]
+            files = sorted((c for c in kids if c.children is None), key=lambda c: _sort_key(c.path))
+            folders = sorted((c for c in kids if c.children is not None),
+                             key=lambda c: _sort_key(c.path), reverse=True)
+            for f in files:
+                yield f.path
+            stack.extend(folders)
+
+
+FILTER_MODES = ("contém", "glob", "fuzzy")
+FILTER_MAX_SHOWN = 1000   # arquivos desenhados na lista filtrada (marcar pega todos)
+FILTER_DEBOUNCE_MS = 120  # espera a digitação parar antes de buscar
+
+def _glob_regex(pattern):
+    # glob -> regex de uma linha do índice ("\n" + linha): * e ? não passam de "/", ** passa
+    out, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            # "**/" também vale zero pastas: src/**/test_* pega src/test_a.py
+            out.append("(?:[^\n]*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append("[^\n]*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/\n]*")
+        elif c == "?":
+            out.append("[^/\n]")
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            j = pattern.find("]", i + 2)
+            body = pattern[i + 1:j]
+            negate = body[:1] in ("!", "^")
+            body = re.sub(r"([\\\]^])", r"\\\1", body[1:] if negate else body)
+            out.append(f"[^/\n{body}]" if negate else f"[{body}]")
+            i = j + 1
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("\n" + "".join(out) + "(?=\n)")
+
+# quantificador possessivo só existe no re do 3.11+; sem ele o padrão continua
+# linear ([^c]*c só para no primeiro c), mas recua letra a letra nas linhas que falham
+_POSSESSIVE = "+" if sys.version_info >= (3, 11) else ""
+
+def _fuzzy_regex(query):
+    # subsequência: cada letra casa na primeira ocorrência depois da anterior
+    first, rest = re.escape(query[0]), "".join(
+        f"[^\n{re.escape(c)}]*{_POSSESSIVE}{re.escape(c)}" for c in query[1:])
+    return re.compile(f"\n[^\n{first}]*{_POSSESSIVE}({first}{rest})")
+
+def _is_subsequence(short, long):
+    it = iter(long)
+    return all(c in it for c in short)
+
+class PathIndex(object):
+    # Índice de busca sobre os arquivos varridos, montado uma vez por estrutura:
+    # os caminhos relativos (minúsculos) num único texto, cada linha precedida
+    # de "\n", e a posição desse "\n" -> número da linha. Cada busca é uma
+    # varredura em C sobre o texto; refinar a busca anterior (digitar mais uma
+    # letra) só reconfere as linhas que já tinham casado.
+    def __init__(self, root, paths):
+        self.paths = list(paths)
+        cut = len(root) if root.endswith(("/", os.sep)) else len(root) + 1  # "C:/" já tem a barra
+        self.lines = [p[cut:].replace(os.sep, "/").lower() for p in self.paths]
+        self.text, self.line_of = self._join(self.lines)
+        self.names, self.name_of = self._join([r.rsplit("/", 1)[-1] for r in self.lines])
+        # fim de cada linha no texto (posição do "\n" seguinte)
+        self.ends = sorted(self.line_of)[1:] + [len(self.text) - 1]
+        self._last = None  # (modo, consulta, resultado)
+        self.line_bits = len(self.paths).bit_length()  # nº da linha na chave do fuzzy
+
+    @staticmethod
+    def _join(lines):
+        line_of, pos = {}, 0
+        for i, line in enumerate(lines):
+            line_of[pos] = i
+            pos += len(line) + 1
+        return "\n" + "\n".join(lines) + "\n", line_of
+
+    def __len__(self):
+        return len(self.paths)
+
+    def search(self, query, mode="contém"):
+        # índices (em self.paths) dos arquivos que casam, na ordem de exibição;
+        # no fuzzy, do melhor para o pior
+        query = "".join(query.split()).lower() if mode == "fuzzy" else query.strip().lower()
+        if not query:
+            return []
+        # refinar só compensa quando o resultado anterior é bem menor que o índice
+        last = self._last
+        if last and (last[0] != mode or len(last[2]) * 8 > len(self.paths)):
+            last = None
+        if mode == "glob":
+            # sem "/" o padrão vale para o nome do arquivo (como "*.py")
+            if "/" in query:
+                hits = self._regex_lines(_glob_regex(query.lstrip("/")), self.text, self.line_of)
+            else:
+                hits = self._regex_lines(_glob_regex(query), self.names, self.name_of)
+        elif mode == "fuzzy":
+            if last and _is_subsequence(last[1], query):
+                hits = self._fuzzy(query, last[2])
+            else:
+                hits = self._fuzzy(query)
+        elif last and last[1] in query:
+            lines = self.lines
+            hits = [i for i in last[2] if query in lines[i]]
+        else:
+            hits = self._find_lines(query)
+        self._last = (mode, query, hits)
+        return hits
+
+    def _find_lines(self, query):
+        # str.find em C; uma entrada por linha, pulando o resto dela
+        hits, text, line_of = [], self.text, self.line_of
+        find, rfind = text.find, text.rfind
+        pos = find(query)
+        while pos != -1:
+            start = rfind("\n", 0, pos)
+            hits.append(line_of[start])
+            pos = find(query, find("\n", pos))
+        return hits
+
+    @staticmethod
+    def _regex_lines(regex, text, line_of):
+        return [line_of[m.start()] for m in regex.finditer(text)]
+
+    def _fuzzy(self, query, candidates=None):
+        # casamentos mais curtos vêm primeiro; no empate, os mais perto do fim
+        # da linha (dentro do nome do arquivo). A chave vai num int só
+        # (tamanho | distância | linha), que ordena bem mais rápido que tuplas
+        regex = _fuzzy_regex(query)
+        bits = self.line_bits
+        if candidates is None:
+            # letra rara na consulta: só as linhas que a têm (str.find em C)
+            count = self.text.count
+            rare = min(set(query), key=count)
+            if count(rare) * 8 < len(self.paths):
+                candidates = self._find_lines(rare)
+        if candidates is None:
+            line_of, ends = self.line_of, self.ends
+            keys = [((((m.end() - start) << 21) | (ends[i] - start)) << bits) | i
+                    for m in regex.finditer(self.text)
+                    for start, i in ((m.start(1), line_of[m.start()]),)]
+        else:
+            keys, lines = [], self.lines
+            for i in candidates:
+                m = regex.match("\n" + lines[i])
+                if m is not None:
+                    start = m.start(1)
+                    keys.append(((((m.end() - start) << 21) | (m.endpos - start)) << bits) | i)
+        keys.sort()
+        mask = (1 << bits) - 1
+        return [key & mask for key in keys]
+
+
+CHECK_ON, CHECK_OFF, CHECK_PARTIAL = "☑", "☐", "◩"
+PLACEHOLDER = "::carregando"
+DUPLICATES_MODE = "duplicados"  # "modo" da lista de resultados quando mostra os idênticos
+
+class CheckTree(object):
+    # Árvore de seleção virtualizada sobre um ttk.Treeview: os itens de uma pasta
+    # só são criados quando ela é aberta, e a marcação fica numa SelectionTrie
+    # em vez de um IntVar por caminho.
+    def __init__(self, parent, root_path, saved=None):
+        self.root_path = root_path
+        self.saved = set(saved or [])
+        self.saved_dirs = self._ancestors(self.saved)  # pastas que abrem expandidas
+        self.structure = {}
+        self.nodes = {root_path: self.structure}  # pasta -> dict dos filhos
+        self.scanned = set()                      # pastas cujo lote já chegou
+        self.loaded = {root_path}                 # pastas com filhos no Treeview
+        self.selection = SelectionTrie(root_path)
+        self.complete = False                     # varredura terminou
+        self.auto_select = set()                  # pastas novas que nascem marcadas
+        self.path_index = None                    # PathIndex da busca (refeito quando a árvore muda)
+        self.query = None                         # (texto, modo) do filtro ativo
+        self.matches = []                         # arquivos que casam com o filtro
+        self.on_change = None                     # chamado quando a seleção/os totais mudam
+        self.outlined = set()                     # arquivos exportados só como esboço (botão direito)
+        self.sizes = {}                           # arquivo -> bytes (stat da varredura)
+        self.duplicate_groups = {}                # arquivo -> nº do grupo de idênticos
+        self.duplicates = []                      # grupos [(hash, [caminhos])] do último "Achar duplicados"
+
+        import tkinter as tk
+        from tkinter import ttk
+        self.frame = tk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, show="tree", selectmode="none")
+        # lista filtrada: outro Treeview só com os galhos que casam; a árvore
+        # principal fica intacta por baixo e volta quando o filtro é limpo
+        self.results = ttk.Treeview(self.frame, show="tree", selectmode="none")
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.scrollbar.set)
+        self.results.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.tree.bind("<<TreeviewOpen>>", self._on_open)
+        for view in (self.tree, self.results):
+            view.bind("<Button-1>", self._on_click)
+            view.bind("<space>", lambda e: self.toggle(e.widget.focus()))
+            # botão direito: esboço por arquivo/pasta (Button-2 no macOS)
+            for button in ("<Button-3>", "<Button-2>" if sys.platform == "darwin" else None):
+                if button:
+                    view.bind(button, lambda e: self.toggle_outline(e.widget.identify_row(e.y)))
+
+    def pack(self, **kw):
+        self.frame.pack(**kw)
+
+    def _ancestors(self, paths):
+        dirs = set()
+        for path in paths:
+            parent = os.path.dirname(path)
+            while parent not in dirs and len(parent) > len(self.root_path):
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+        return dirs
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    # -- modelo --
+    def add_batch(self, current, entries, sizes=None):
+        # sizes: {arquivo: bytes} do stat feito na varredura (para a estimativa do export)
+        start = time.perf_counter()
+        try:
+            self._add_batch(current, entries, sizes or {})
+        finally:
+            metrics.add("tree_build", time.perf_counter() - start)
+        self._changed()
+
+    def _add_batch(self, current, entries, sizes):
+        node = self.nodes.get(current)
+        if node is None:
+            return
+        self.path_index = None
+        inherit = current in self.auto_select
+        if node:
+            # lote de uma pasta que o modo observar já começou a preencher
+            entries = [(full, is_dir) for full, is_dir in entries if full not in node]
+        for full, is_dir in entries:
+            if is_dir:
+                node[full] = self.nodes[full] = {}
+                if inherit:
+                    self.auto_select.add(full)
+                size = 0
+            else:
+                node[full] = None
+                self.sizes[full] = sizes.get(full, 0)
+                size = estimate_block_size(full, self.sizes[full])
+            self.selection.add(current, full, is_dir, inherit or full in self.saved, size)
+        self.scanned.add(current)
+        if current in self.loaded:
+            self._insert_children(current, entries)
+        elif not entries and self.tree.exists(current + PLACEHOLDER):
+            # pasta vazia: some a seta de expandir
+            self.tree.delete(current + PLACEHOLDER)
+        # os contadores desta pasta e das de cima mudaram
+        self._refresh_ancestors(current, include_self=True)
+
+    def add_entry(self, parent, path, is_dir, size=0):
+        # arquivo/pasta que apareceu no disco (modo observar)
+        node = self.nodes.get(parent)
+        if node is None or path in node:
+            return False
+        self.path_index = None
+        # nasce marcado se estava marcado antes de sumir ou se a pasta toda está marcada
+        inherit = self.selection.state(parent) == SelectionTrie.CHECKED
+        if is_dir:
+            node[path] = self.nodes[path] = {}
+            if inherit:
+                self.auto_select.add(path)
+        else:
+            node[path] = None
+            self.sizes[path] = size
+        size = 0 if is_dir else estimate_block_size(path, size)
+        self.selection.add(parent, path, is_dir, inherit or path in self.saved, size)
+        if parent in self.loaded:
+            self._insert_sorted(parent, path, is_dir)
+        self._refresh_ancestors(path)
+        self._changed()
+        return True
+
+    def remove_entry(self, path):
+        # arquivo/pasta que sumiu do disco, com tudo que havia dentro
+        node = self.selection.index.get(path)
+        if node is None or node.parent is None:
+            return False
+        parent = node.parent.path
+        self.path_index = None
+        # marcados voltam marcados se o arquivo reaparecer (salvar por rename, git checkout)
+        self.saved.update(self.selection.iter_selected(path))
+        self.nodes[parent].pop(path, None)
+        stack = [path]
+        while stack:
+            p = stack.pop()
+            children = self.nodes.pop(p, None)
+            if children is not None:
+                self.scanned.discard(p)
+                self.loaded.discard(p)
+                self.auto_select.discard(p)
+                stack.extend(children)
+        self.selection.remove(path)
+        if self.tree.exists(path):
+            self.tree.delete(path)
+        self._refresh_ancestors(parent, include_self=True)
+        self._changed()
+        return True
+
+    def apply_events(self, events, sizes=None):
+        # aplica um lote de eventos do observador; devolve False se for preciso revarrer
+        for kind, *payload in events:
+            if kind == "add":
+                self.add_entry(*payload)
+            elif kind == "batch":
+                self.add_batch(*payload, sizes=sizes)
+            elif kind == "size":
+                path, size = payload
+                if path in self.sizes:
+                    self.sizes[path] = size
+                self.selection.resize(path, estimate_block_size(path, size))
+                self._changed()
+            elif kind == "remove":
+                self.remove_entry(*payload)
+            elif kind == "rescan":
+                return False
+        self.refilter()
+        return True
+
+    def watch_dirs(self):
+        # cópia das pastas conhecidas para o observador (que roda em outra thread)
+        return {folder: [(p, sub is not None) for p, sub in node.items()]
+                for folder, node in self.nodes.items()}
+
+    def is_folder(self, path):
+        return path in self.nodes
+
+    def iter_files(self, folder=None):
+        return iter_structure_files(self.nodes[folder or self.root_path])
+
+    def selected_files(self):
+        return list(self.selection.iter_selected())
+
+    def selection_to_save(self):
+        # seleção para o histórico: com a varredura ainda em andamento, os caminhos
+        # salvos que não chegaram na árvore continuam marcados em vez de sumirem
+        selected = self.selected_files()
+        if not self.complete:
+            selected.extend(p for p in self.saved if p not in self.selection)
+        return selected
+
+    def selection_totals(self):
+        # (arquivos, bytes estimados do export) da seleção, sem abrir nenhum arquivo
+        return self.selection.totals()
+
+    def toggle(self, item):
+        if not item or item.endswith(PLACEHOLDER) or item not in self.selection:
+            return
+        self.selection.toggle(item)
+        self._refresh(item)
+        self._refresh_results()
+        self._changed()
+
+    def toggle_outline(self, item):
+        # liga/desliga o esboço do arquivo, ou de todos os arquivos de código da pasta
+        if not item or item.endswith(PLACEHOLDER) or item not in self.selection:
+            return
+        files = [p for p in (self.iter_files(item) if self.is_folder(item) else [item])
+                 if outline_language(p) is not None]
+        if not files:
+            return
+        if all(p in self.outlined for p in files):
+            self.outlined.difference_update(files)
+        else:
+            self.outlined.update(files)
+        self._refresh(item)
+        self._refresh_results()
+
+    def select_all(self):
+        self.selection.select_all()
+        self._refresh_all()
+        self._changed()
+
+    def clear(self):
+        self.selection.clear()
+        self._refresh_all()
+        self._changed()
+
+    # -- filtro --
+    def filter(self, query, mode="contém"):
+        # mostra só os galhos com arquivos que casam; devolve quantos casaram
+        if self.path_index is None:
+            self.path_index = PathIndex(self.root_path, self.iter_files())
+        paths = self.path_index.paths
+        hits = self.path_index.search(query, mode)
+        self.query = (query, mode)
+        self.matches = [paths[i] for i in hits]
+        if mode == "fuzzy":
+            # os melhores primeiro, mas desenhados na ordem da árvore (o índice é essa ordem)
+            shown = [paths[i] for i in sorted(hits[:FILTER_MAX_SHOWN])]
+        else:
+            shown = self.matches[:FILTER_MAX_SHOWN]
+        self._show_results(shown)
+        return len(self.matches)
+
+    def clear_filter(self):
+        if self.query is None:
+            return
+        self.query = None
+        self.matches = []
+        self.results.delete(*self.results.get_children())
+        self.results.pack_forget()
+        self.scrollbar.configure(command=self.tree.yview)
+        self.tree.pack(side="left", fill="both", expand=True)
+
+    def refilter(self):
+        # a árvore mudou (varredura terminou, modo observar): refaz a busca ativa
+        if self.query is None:
+            return
+        if self.query[1] == DUPLICATES_MODE:
+            self.show_duplicates(self.duplicates)
+        else:
+            self.filter(*self.query)
+
+    def show_duplicates(self, groups):
+        # marca os grupos de idênticos na árvore e lista só eles; os "resultados"
+        # (para Marcar/Desmarcar resultados) são as cópias, sem o primeiro de cada grupo
+        groups = [(d, [p for p in g if p in self.selection]) for d, g in groups]
+        self.duplicates = [(d, g) for d, g in groups if len(g) > 1]
+        flagged = set(self.duplicate_groups)
+        self.duplicate_groups = {p: n for n, (_, g) in enumerate(self.duplicates, 1) for p in g}
+        self.query = ("", DUPLICATES_MODE)
+        self.matches = [p for _, g in self.duplicates for p in g[1:]]
+        order = {p: i for i, p in enumerate(self.iter_files())}
+        shown = sorted(self.duplicate_groups, key=order.__getitem__)[:FILTER_MAX_SHOWN]
+        self._show_results(shown)
+        for path in flagged | set(self.duplicate_groups):
+            if self.tree.exists(path):
+                self.tree.item(path, text=self._label(path))
+        return len(self.matches)
+
+    def set_matches(self, value):
+        # marca/desmarca todos os resultados do filtro, não só os desenhados
+        for path in self.matches:
+            if path in self.selection:
+                self.selection.set(path, value)
+        self._refresh_all()
+        self._changed()
+
+    def _show_results(self, shown):
+        view = self.results
+        view.delete(*view.get_children())
+        root = self.root_path
+        made = set()
+        for path in shown:
+            # cria as pastas do caminho que ainda não estão na lista
+            chain, folder = [], os.path.dirname(path)
+            while folder != root and folder not in made and len(folder) > len(root):
+                chain.append(folder)
+                folder = os.path.dirname(folder)
+            for folder in reversed(chain):
+                parent = os.path.dirname(folder)
+                view.insert("" if parent == root else parent, "end", iid=folder,
+                            text=self._label(folder), open=True)
+                made.add(folder)
+            parent = os.path.dirname(path)
+            view.insert("" if parent == root else parent, "end", iid=path, text=self._label(path))
+        metrics.count("widgets", len(shown) + len(made))
+        if not view.winfo_manager():
+            self.tree.pack_forget()
+            self.scrollbar.configure(command=view.yview)
+            view.pack(side="left", fill="both", expand=True)
+
+    def _refresh_results(self):
+        if self.query is None:
+            return
+        stack = list(self.results.get_children())
+        while stack:
+            item = stack.pop()
+            self.results.item(item, text=self._label(item))
+            stack.extend(self.results.get_children(item))
+
+    # -- Treeview --
+    def _label(self, path):
+        state = self.selection.state(path)
+        mark = CHECK_ON if state == SelectionTrie.CHECKED else (
+            CHECK_PARTIAL if state == SelectionTrie.PARTIAL else CHECK_OFF)
+        suffix = "  ⟨esboço⟩" if path in self.outlined else ""
+        group = self.duplicate_groups.get(path)
+        if group is not None:
+            suffix += f"  ⧉{group}"
+        return f"{mark} {os.path.basename(path)}{suffix}"
+
+    def _insert_children(self, folder, entries):
+        parent = "" if folder == self.root_path else folder
+        files = sorted((p for p, is_dir in entries if not is_dir), key=_sort_key)
+        folders = sorted((p for p, is_dir in entries if is_dir), key=_sort_key)
+        metrics.count("widgets", len(files) + len(folders))
+        for path in files:
+            self.tree.insert(parent, "end", iid=path, text=self._label(path))
+        for path in folders:
+            # como antes: pastas com algo salvo/marcado já abrem expandidas
+            is_open = path in self.saved_dirs or self.selection.state(path) != SelectionTrie.UNCHECKED
+            self.tree.insert(parent, "end", iid=path, text=self._label(path), open=is_open)
+            if is_open:
+                self._load(path)
+            else:
+                self.tree.insert(path, "end", iid=path + PLACEHOLDER, text="…")
+
+    def _insert_sorted(self, folder, path, is_dir):
+        # mesma ordem do _insert_children: arquivos e depois pastas, por nome
+        parent = "" if folder == self.root_path else folder
+        key = (is_dir, _sort_key(path))
+        index = 0
+        for i, sibling in enumerate(self.tree.get_children(parent)):
+            if (sibling in self.nodes, _sort_key(sibling)) < key:
+                index = i + 1
+        self.tree.insert(parent, index, iid=path, text=self._label(path))
+        metrics.count("widgets")
+        if is_dir:
+            self.tree.insert(path, "end", iid=path + PLACEHOLDER, text="…")
+
+    def _load(self, folder):
+        if folder in self.loaded:
+            return
+        self.loaded.add(folder)
+        if self.tree.exists(folder + PLACEHOLDER):
+            self.tree.delete(folder + PLACEHOLDER)
+        if folder in self.scanned:
+            node = self.nodes[folder]
+            self._insert_children(folder, [(p, sub is not None) for p, sub in node.items()])
+
+    def _on_open(self, event=None):
+        item = self.tree.focus()
+        if self.is_folder(item):
+            self._load(item)
+
+    def _on_click(self, event):
+        view = event.widget
+        if "indicator" in view.identify_element(event.x, event.y):
+            return
+        self.toggle(view.identify_row(event.y))
+
+    def _refresh(self, path):
+        # atualiza o item, os descendentes já criados e as pastas acima
+        stack = [path]
+        while stack:
+            p = stack.pop()
+            if self.tree.exists(p):
+                self.tree.item(p, text=self._label(p))
+            if p in self.loaded:
+                stack.extend(self.nodes[p])
+        self._refresh_ancestors(path)
+
+    def _refresh_ancestors(self, path, include_self=False):
+        node = self.selection.index[path]
+        if not include_self:
+            node = node.parent
+        # um item existe no Treeview quando a pasta dele já foi carregada
+        while node is not None and node.parent is not None:
+            if node.parent.path in self.loaded:
+                self.tree.item(node.path, text=self._label(node.path))
+            node = node.parent
+
+    def _refresh_all(self):
+        self._refresh(self.root_path)
+        self._refresh_results()
+
+
 def show_selection_gui(window, base_path, saved_selection=None):
+    import tkinter as tk
+    from tkinter import filedialog, Button, Frame, BOTH, RIGHT, LEFT, Y, messagebox
+    import pyperclip
+
     window.title("Seleção de Arquivos")
     window.geometry("900x700")
     window.resizable(True, True)
@@ -219,6 +3007,15 @@ def show_selection_gui(window, base_path, saved_selection=None):
     BASE_DIR = abs_base
     _build_spec()
 
+    # barra de status com os tempos e contadores acumulados da instrumentação
+    metrics_bar = tk.Label(window, text="", anchor="w", fg="#555", bd=1, relief="sunken")
+    metrics_bar.pack(side=tk.BOTTOM, fill="x")
+
+    def refresh_metrics():
+        if not metrics_bar.winfo_exists():
+            return
+        metrics_bar.config(text=metrics.summary())
+        window.after(METRICS_REFRESH_MS, refresh_metrics)
 
     left_frame = Frame(window)
     left_frame.pack(side=tk.LEFT, fill=BOTH, expand=True)
@@ -226,14 +3023,15 @@ def show_selection_gui(window, base_path, saved_selection=None):
     right_frame = Frame(window, width=380, bg="#f8f8f8", bd=1, relief="solid")
     right_frame.pack(side=tk.RIGHT, fill=Y)
 
-    history = load_history()
+    store = get_history_store()
+    history = store.entries()
 
     # Toolbar (ícone para abrir a pasta no Explorer/Finder)
     toolbar = Frame(right_frame, bg="#f8f8f8")
     toolbar.pack(fill="x", padx=6, pady=(8, 0))
 
     # Listbox do histórico
-    hist_listbox = create_history_listbox(right_frame, history)
+    hist_listbox = create_history_listbox(right_frame, store)
     current_path = abs_base
     current_saved = set(saved_selection or [])
 
@@ -266,11 +3064,97 @@ def show_selection_gui(window, base_path, saved_selection=None):
     current_path = abs_base
     current_saved = set(saved_selection or [])
 
-    vars_dict = {}
+    check_tree = None
+    scan_worker = None
+    export_worker = None
+    watcher = None
 
     bottom = Frame(left_frame)
     bottom.pack(fill="x", pady=5)
 
+    # filtro acima da árvore: busca no índice dos caminhos já varridos,
+    # sem voltar ao disco nem recriar a árvore inteira
+    filter_bar = Frame(left_frame)
+    filter_bar.pack(fill="x", padx=5)
+    filter_var = tk.StringVar()
+    filter_mode = tk.StringVar(value=FILTER_MODES[0])
+    filter_job = None
+
+    def run_filter():
+        nonlocal filter_job
+        filter_job = None
+        if check_tree is None:
+            return
+        query = filter_var.get()
+        if not query.strip():
+            check_tree.clear_filter()
+            status_label.config(text="")
+            return
+        found = check_tree.filter(query, filter_mode.get())
+        shown = f" (mostrando {FILTER_MAX_SHOWN})" if found > FILTER_MAX_SHOWN else ""
+        status_label.config(text=f"{found} resultados{shown}")
+
+    def schedule_filter(*_):
+        nonlocal filter_job
+        if filter_job is not None:
+            window.after_cancel(filter_job)
+        filter_job = window.after(FILTER_DEBOUNCE_MS, run_filter)
+
+    def mark_matches(value):
+        if check_tree is None or check_tree.query is None:
+            show_toast(window, "Digite um filtro primeiro.")
+            return
+        check_tree.set_matches(value)
+        verb = "marcados" if value else "desmarcados"
+        show_toast(window, f"{len(check_tree.matches)} arquivos {verb}.")
+
+    tk.Label(filter_bar, text="Filtrar:").pack(side=LEFT)
+    filter_entry = tk.Entry(filter_bar, textvariable=filter_var)
+    filter_entry.pack(side=LEFT, fill="x", expand=True, padx=5)
+    filter_entry.bind("<Escape>", lambda e: filter_var.set(""))
+    filter_var.trace_add("write", schedule_filter)
+    tk.OptionMenu(filter_bar, filter_mode, *FILTER_MODES, command=schedule_filter).pack(side=LEFT)
+    Button(filter_bar, text="Marcar resultados", command=lambda: mark_matches(True)).pack(side=LEFT, padx=2)
+    Button(filter_bar, text="Desmarcar resultados", command=lambda: mark_matches(False)).pack(side=LEFT, padx=2)
+
+    def find_duplicates_in_tree():
+        # hash só dos arquivos com tamanho repetido, numa thread; depois lista os grupos
+        view = check_tree
+        if view is None or not view.complete:
+            show_toast(window, "Aguarde a varredura terminar.")
+            return
+        worker = DuplicateWorker(view.iter_files(), view.sizes)
+        status_label.config(text="Procurando arquivos idênticos…")
+
+        def poll():
+            nonlocal filter_job
+            if view is not check_tree or not view.tree.winfo_exists():
+                worker.cancel()
+                return
+            try:
+                kind, payload = worker.queue.get_nowait()
+            except queue.Empty:
+                window.after(SCAN_POLL_MS, poll)
+                return
+            if kind == "error":
+                status_label.config(text="")
+                messagebox.showerror("Erro", str(payload))
+                return
+            # limpa o filtro sem deixar o run_filter agendado apagar a lista de duplicados
+            filter_var.set("")
+            if filter_job is not None:
+                window.after_cancel(filter_job)
+                filter_job = None
+            copies = view.show_duplicates(payload)
+            wasted = sum(view.sizes.get(p, 0) for p in view.matches)
+            status_label.config(text=f"{len(view.duplicates)} grupos idênticos, {copies} cópias "
+                                     f"({format_bytes(wasted)})" if copies else "Nenhum arquivo idêntico.")
+
+        worker.start()
+        poll()
+
+    Button(filter_bar, text="Achar duplicados", command=find_duplicates_in_tree).pack(side=LEFT, padx=2)
+
     # save_checkbox = Checkbutton(bottom, text="Salvar Seleção (histórico é automático)")
     # save_checkbox.pack(side=LEFT, padx=5)
     # save_checkbox.config(state="disabled")
@@ -282,10 +3166,9 @@ def show_selection_gui(window, base_path, saved_selection=None):
         sel_idx = sel[0] if sel else None
 
         hist_listbox.delete(0, tk.END)
-        history = load_history()
+        history = store.entries()
         for entry in history:
-            display_name = entry.get("name") or os.path.basename(entry.get("path") or "") or "Nenhuma pasta"
-            hist_listbox.insert(tk.END, display_name)
+            hist_listbox.insert(tk.END, history_display_name(entry))
         
         # restaura seleção, se possível
         if sel_idx is not None and sel_idx < len(history):
@@ -295,137 +3178,241 @@ def show_selection_gui(window, base_path, saved_selection=None):
         # habilita/desabilita o botão abrir
         open_btn.config(state=(tk.NORMAL if history else tk.DISABLED))
 
-    def load_selection(path, saved):
-        nonlocal current_path, current_saved, vars_dict
+    def stop_watch():
+        nonlocal watcher
+        if watcher is not None:
+            watcher.stop()
+            watcher = None
+
+    def start_watch(view):
+        nonlocal watcher
+        stop_watch()
+        if view is not check_tree or not view.complete:
+            return  # começa sozinho quando a varredura terminar
+        w = watcher = create_watcher(view.root_path, view.watch_dirs())
+        pending = []
+        first = last = 0.0
+
+        def drain_watch():
+            nonlocal first, last
+            if w is not watcher or not view.tree.winfo_exists():
+                return
+            now = time.perf_counter()
+            try:
+                while True:
+                    pending.append(w.queue.get_nowait())
+                    if len(pending) == 1:
+                        first = now
+                    last = now
+            except queue.Empty:
+                pass
+            # debounce: aplica quando a rajada acalma (ou demorou demais)
+            if pending and (now - last >= WATCH_DEBOUNCE_MS / 1000
+                            or now - first >= WATCH_MAX_DELAY_MS / 1000):
+                events = pending[:]
+                del pending[:]
+                if not view.apply_events(events, sizes=w.sizes):
+                    # eventos perdidos (fila do inotify estourou): revarre mantendo a seleção
+                    load_selection(view.root_path, view.selected_files())
+                    return
+            window.after(WATCH_POLL_MS, drain_watch)
+
+        w.start()
+        drain_watch()
+
+    def toggle_watch():
+        if watch_var.get():
+            if check_tree is not None:
+                start_watch(check_tree)
+        else:
+            stop_watch()
+
+    def load_selection(path, saved, snapshot=None):
+        nonlocal current_path, current_saved, check_tree, scan_worker
+        # cancela a varredura anterior (troca de histórico no meio do scan)
+        if scan_worker is not None:
+            scan_worker.cancel()
+            scan_worker = None
+        stop_watch()
         current_path = path
         current_saved = set(saved or [])
         for widget in left_frame.winfo_children():
-            if widget != bottom: widget.destroy()
-        vars_dict.clear()
-
-        canvas = Canvas(left_frame)
-        scrollbar = Scrollbar(left_frame, orient=VERTICAL, command=canvas.yview)
-        scroll_f = Frame(canvas)
-        scroll_f.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.create_window((0, 0), window=scroll_f, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        canvas.pack(side=LEFT, fill=BOTH, expand=True)
-        scrollbar.pack(side=RIGHT, fill=Y)
-
-        # Suporte ao scroll do mouse (Windows, Linux, Mac)
-        def _on_mousewheel(event):
-            if event.num == 4 or event.delta > 0:
-                canvas.yview_scroll(-1, "units")
-            elif event.num == 5 or event.delta < 0:
-                canvas.yview_scroll(1, "units")
-
-        canvas.bind_all("<MouseWheel>", _on_mousewheel)      # Windows/Mac
-        canvas.bind_all("<Button-4>", _on_mousewheel)        # Linux scroll up
-        canvas.bind_all("<Button-5>", _on_mousewheel)        # Linux scroll down
-
-
-        def toggle_visibility(button, frame):
-            if frame.winfo_viewable():
-                frame.pack_forget()
-                button.config(text="+")
-            else:
-                frame.pack(fill="x")
-                button.config(text="-")
-
-        def update_folder_selection(var, folder_dict):
-            def toggle(status, d):
-                for p, v in d.items():
-                    if isinstance(v, dict): toggle(status, v)
-                    else: vars_dict[p].set(status)
-            toggle(var.get(), folder_dict)
-
-        def add_items(parent_frame, parent_dict, level=0):
-            files = [(p, s) for p, s in parent_dict.items() if s is None]
-            folders = [(p, s) for p, s in parent_dict.items() if isinstance(s, dict)]
-            for path, _ in sorted(files, key=lambda kv: os.path.basename(kv[0]).lower()):
-                name = os.path.basename(path)
-                var = IntVar(master=window, value=1 if path in current_saved else 0)
-                vars_dict[path] = var
-                Checkbutton(
-                    parent_frame,
-                    text=name,
-                    variable=var
-                ).pack(anchor="w", padx=20)
-            for path, subtree in sorted(folders, key=lambda kv: os.path.basename(kv[0]).lower()):
-                name = os.path.basename(path)
-                var = IntVar(master=window, value=1 if any(p.startswith(path) for p in current_saved) else 0)
-                vars_dict[path] = var
-                folder_frame = Frame(parent_frame, bg="#e0e3f1" if level % 2 == 0 else "#e6d7d7", bd=1, relief="solid")
-                folder_frame.pack(padx=20 + (level * 20), pady=10, anchor="w")
-                relative_path = os.path.relpath(path, current_path)
-                Checkbutton(
-                    folder_frame,
-                     text=f"{name}  ({relative_path})",
-                    variable=var,
-                    command=lambda v=var, d=subtree: update_folder_selection(v, d),
-                    bg=folder_frame["bg"],
-                    font=("Segoe UI Semibold", 10)
-                ).pack(side=LEFT, padx=5)
-                toggle_btn = Button(folder_frame, width=2)
-                child_frame = Frame(parent_frame)
-                pad = 20 + (level * 20)
-                # inicializa só se marcado, e sempre logo após folder_frame
-                if var.get():
-                    toggle_btn.config(text="-")
-                    child_frame.pack(padx=pad, anchor="w", after=folder_frame)
-                else:
-                    toggle_btn.config(text="+")
-                def _toggle(b=toggle_btn, f=child_frame, p=pad, frm=folder_frame):
-                    if f.winfo_viewable():
-                        f.pack_forget()
-                        b.config(text="+")
+            if widget not in (bottom, filter_bar): widget.destroy()
+        filter_var.set("")
+
+        view = check_tree = CheckTree(left_frame, path, current_saved)
+        view.pack(side=LEFT, fill=BOTH, expand=True)
+        view.on_change = update_totals
+
+        # varredura em segundo plano: a árvore é preenchida conforme os lotes chegam
+        # (com o snapshot da última sessão, primeiro a árvore salva e depois só o que mudou)
+        worker = ScanWorker(path, snapshot)
+        scan_worker = worker
+        verifying = False  # árvore do snapshot já na tela, conferindo com o disco
+
+        def drain_scan():
+            nonlocal verifying
+            if worker is not scan_worker or not view.tree.winfo_exists():
+                return
+            deadline = time.perf_counter() + SCAN_DRAIN_BUDGET
+            done = False
+            try:
+                while time.perf_counter() < deadline:
+                    kind, *payload = worker.queue.get_nowait()
+                    if kind == "batch":
+                        view.add_batch(*payload, sizes=worker.sizes)
+                    elif kind == "events":
+                        view.apply_events(payload[0], sizes=worker.sizes)
+                    elif kind == "checked":
+                        # marcação do fim da última sessão (pode ser mais nova que a do histórico)
+                        view.saved = payload[0]
+                        view.saved_dirs = view._ancestors(view.saved)
+                    elif kind == "ready":
+                        verifying = True
+                    elif kind == "error":
+                        messagebox.showerror("Erro", str(payload[0]))
                     else:
-                        # repack logo abaixo da pasta correta
-                        f.pack(padx=p, anchor="w", after=frm)
-                        b.config(text="-")
-                toggle_btn.config(command=_toggle)
-                toggle_btn.pack(anchor="w", padx=5)
-                add_items(child_frame, subtree, level=level + 1)
-
-
-        dir_structure = get_directory_structure(path)
-        add_items(scroll_f, dir_structure)
-
-    def on_ok():
-        selected = [p for p, v in vars_dict.items() if v.get()]
-        out_file = "output.txt"
+                        view.complete = done = True
+                        break
+            except queue.Empty:
+                pass
+            counter = f"{worker.dirs} pastas / {worker.files} arquivos escaneados"
+            if verifying and not done:
+                counter = "Verificando alterações: " + counter
+            if done:
+                status_label.config(text=counter)
+                view.refilter()
+                if watch_var.get():
+                    start_watch(view)
+                restat_selection(view)
+            else:
+                status_label.config(text=counter + "…")
+                window.after(SCAN_POLL_MS, drain_scan)
+
+        worker.start()
+        drain_scan()
+
+    def restat_selection(view):
+        # tamanhos do cache da varredura podem estar velhos: confere só os marcados
+        worker = RestatWorker(view.selected_files(), view.sizes)
+
+        def poll():
+            if view is not check_tree or not view.tree.winfo_exists():
+                worker.cancel()
+                return
+            try:
+                kind, payload = worker.queue.get_nowait()
+            except queue.Empty:
+                window.after(SCAN_POLL_MS, poll)
+                return
+            if kind == "done" and payload:
+                view.apply_events(payload)
+
+        worker.start()
+        poll()
+
+    def on_ok(close=False, delta=False):
+        nonlocal export_worker
+        if export_worker is not None:
+            show_toast(window, "Cópia em andamento…")
+            return
         try:
-            with open(out_file, "w", encoding="utf-8") as out:
-                for fp in selected:
-                    try:
-                        with open(fp, "r", encoding="utf-8") as f:
-                            out.write(f"=== {fp} ===\n")
-                            out.write(f.read() + "\n\n")
-                    except Exception:
-                        continue
-
-            with open(out_file, "r", encoding="utf-8") as out:
-                pyperclip.copy(out.read())
-
-            history = load_history()
-            history = add_or_update_history(history, current_path, selected)
-            save_history(history)
+            budget = parse_budget(budget_var.get())
+        except ValueError:
+            show_toast(window, "Orçamento inválido (ex.: 100000, 100k, 1.5m).")
+            return
+        if check_tree is not None and not check_tree.complete:
+            # arquivos marcados que a varredura ainda não alcançou ficariam de fora
+            # da cópia (e, no delta, o manifesto seria comparado com uma lista pela metade)
+            show_toast(window, "Aguarde a varredura terminar.")
+            return
+        selected = check_tree.selected_files() if check_tree else []
+        path = current_path
+        previous = None
+        if delta:
+            # só o que mudou desde a última cópia desta entrada do histórico
+            entry = store.find(path)
+            previous = store.last_export(entry) if entry else {}
+        split = bool(split_var.get())
+        # esboço de tudo, ou só dos arquivos marcados com o botão direito
+        outline = True if outline_var.get() else set(check_tree.outlined) if check_tree else None
+        worker = export_worker = ExportWorker(selected, previous=previous, split=split,
+                                              budget=budget * TOKEN_CHARS if budget else None,
+                                              outline=outline or None, dedupe=bool(dedupe_var.get()),
+                                              sizes=check_tree.sizes if check_tree else None)
+
+        def finish(result):
+            with metrics.span("clipboard", chars=len(result["text"])):
+                pyperclip.copy(result["text"])
+            entry = store.save_selection(path, selected)
+            store.save_export(entry, result["manifest"])
             refresh_hist_listbox()
-            show_toast(window, "Arquivos copiados para o clipboard!")
-        except Exception as e:
-            messagebox.showerror("Erro", str(e))
+            skipped = result["skipped"]
+            parts = result["parts"]
+            if parts and len(parts) > 1:
+                names = ", ".join(os.path.basename(p["file"]) for p in parts[:4])
+                if len(parts) > 4:
+                    names += f" … {os.path.basename(parts[-1]['file'])}"
+                show_toast(window, f"{result['written']} arquivos em {len(parts)} partes: {names}\n"
+                                   f"Parte 1 copiada para o clipboard.", duration=6000)
+                return
+            over = [p for p, reason in skipped if reason == BUDGET_REASON]
+            if over:
+                names = ", ".join(os.path.basename(p) for p in over[:3])
+                if len(over) > 3:
+                    names += f" e mais {len(over) - 3}"
+                show_toast(window, f"{result['written']} arquivos copiados.\n"
+                                   f"{len(over)} não couberam no orçamento: {names}", duration=6000)
+                return
+            if delta:
+                show_toast(window, f"Alterações copiadas: {result['written']} arquivos, "
+                                   f"{len(result['removed'])} removidos.")
+                return
+            if not skipped:
+                copies = f"\n{result['duplicates']} arquivos idênticos viraram referência." \
+                    if result["duplicates"] else ""
+                show_toast(window, "Arquivos copiados para o clipboard!" + copies)
+                return
+            names = ", ".join(f"{os.path.basename(p)} ({reason})" for p, reason in skipped[:3])
+            if len(skipped) > 3:
+                names += f" e mais {len(skipped) - 3}"
+            show_toast(window, f"{result['written']} arquivos copiados.\n{len(skipped)} ignorados: {names}",
+                       duration=6000)
+
+        def poll():
+            nonlocal export_worker
+            try:
+                kind, payload = worker.queue.get_nowait()
+            except queue.Empty:
+                status_label.config(text=f"Copiando {worker.done}/{len(worker.paths)} arquivos…")
+                window.after(SCAN_POLL_MS, poll)
+                return
+            export_worker = None
+            status_label.config(text="")
+            try:
+                if kind == "error":
+                    raise payload
+                finish(payload)
+            except Exception as e:
+                messagebox.showerror("Erro", str(e))
+                return
+            if close:
+                close_window()
+
+        worker.start()
+        poll()
 
     def on_hist_select(event=None):
         sel = hist_listbox.curselection()
         if sel:
             idx = sel[0]
-            entry = load_history()[idx]
+            entry = store.entries()[idx]
             # >>> ADICIONAR <<<
             global BASE_DIR
             BASE_DIR = os.path.abspath(entry["path"])
             _build_spec()
             # -----------------
-            load_selection(entry["path"], entry["selected"])
+            load_selection(entry["path"], store.selection(entry))
 
 
     hist_listbox.bind("<<ListboxSelect>>", on_hist_select)
@@ -433,9 +3420,7 @@ def show_selection_gui(window, base_path, saved_selection=None):
     def open_new_folder():
         new_path = filedialog.askdirectory(title="Selecione a nova pasta")
         if new_path:
-            history = load_history()
-            history = add_or_update_history(history, new_path, [])
-            save_history(history)
+            store.save_selection(new_path, [])
             refresh_hist_listbox()
             hist_listbox.selection_clear(0, tk.END)
             hist_listbox.selection_set(0)
@@ -449,13 +3434,15 @@ def show_selection_gui(window, base_path, saved_selection=None):
             load_selection(new_path, [])
 
     def remove_selected_history():
+        nonlocal scan_worker, check_tree
         sel = hist_listbox.curselection()
         if sel:
             idx = sel[0]
-            history = load_history()
+            history = store.entries()
             if 0 <= idx < len(history):
-                removed = history.pop(idx)
-                save_history(history)
+                removed = history[idx]
+                store.remove(removed)
+                history = store.entries()
                 refresh_hist_listbox()
                 show_toast(window, f'Removido: {removed.get("name") or os.path.basename(removed.get("path"))}')
                 # Seleciona outro item, se existir
@@ -467,75 +3454,392 @@ def show_selection_gui(window, base_path, saved_selection=None):
                     _build_spec()
                     # -----------------
 
-                    load_selection(history[0]["path"], history[0].get("selected", []))
+                    load_selection(history[0]["path"], store.selection(history[0]))
                 else:
                     # Limpa seleção da esquerda se não houver mais histórico
+                    if scan_worker is not None:
+                        scan_worker.cancel()
+                        scan_worker = None
+                    stop_watch()
+                    check_tree = None
                     for widget in left_frame.winfo_children():
-                        if widget != bottom:
+                        if widget not in (bottom, filter_bar):
                             widget.destroy()
 
         # -- logo antes de criar os botões “Selecionar Tudo” etc. --
     def map_structure():
-        structure = get_directory_structure(current_path)
-        # monta linhas da árvore
-        lines = [os.path.basename(current_path) + "/"]
-        def build_tree(d, prefix=""):
-            items = sorted(d.items(), key=lambda kv: os.path.basename(kv[0]).lower())
-            for idx, (path, subtree) in enumerate(items):
-                name = os.path.basename(path)
-                last = (idx == len(items) - 1)
-                connector = "└── " if last else "├── "
-                lines.append(f"{prefix}{connector}{name}{'/' if isinstance(subtree, dict) else ''}")
-                if isinstance(subtree, dict):
-                    extension = "    " if last else "│   "
-                    build_tree(subtree, prefix + extension)
-        build_tree(structure)
-
-        tree_text = "\n".join(lines)
-        # copia pro clipboard
-        pyperclip.copy(tree_text)
-        # mostra em janela
+        try:
+            max_depth = parse_limit(map_depth_var.get())
+            collapse = parse_limit(map_collapse_var.get())
+        except ValueError:
+            show_toast(window, "Profundidade e agrupamento precisam ser números inteiros.")
+            return
+        with metrics.profile("map_structure"), metrics.span("map_structure", root=current_path):
+            # reaproveita a estrutura (e os tamanhos) já varridos pela tela de seleção
+            if check_tree is not None and check_tree.complete:
+                structure, sizes = check_tree.structure, check_tree.sizes
+            else:
+                sizes = {}
+                structure = get_directory_structure(current_path, sizes=sizes)
+            totals = tree_totals(structure, current_path, sizes) if map_sizes_var.get() else None
+            tree_text = render_tree(structure, current_path, max_depth=max_depth, collapse=collapse,
+                                    totals=totals, sizes=totals is not None)
+            # copia pro clipboard
+            pyperclip.copy(tree_text)
+        show_tree_preview(tree_text)
+        show_toast(window, "Árvore copiada para o clipboard!")
+
+    def show_tree_preview(tree_text):
+        # janela do mapa: o texto entra em páginas de TREE_PAGE_LINES linhas, conforme
+        # a rolagem chega perto do fim, em vez de um insert gigante no tk.Text
         tree_win = tk.Toplevel(window)
-        tree_win.title("Estrutura de Pastas (Copiada pro clipboard)")
+        total = tree_text.count("\n") + 1
         txt = tk.Text(tree_win, wrap="none")
-        txt.insert("1.0", tree_text)
-        txt.pack(fill="both", expand=True)
-        # scrollbar horizontal
+        vbar = tk.Scrollbar(tree_win, orient=tk.VERTICAL, command=txt.yview)
         hbar = tk.Scrollbar(tree_win, orient=tk.HORIZONTAL, command=txt.xview)
+        vbar.pack(side=RIGHT, fill=Y)
         hbar.pack(side=tk.BOTTOM, fill=tk.X)
-        txt.config(xscrollcommand=hbar.set)
-
-        show_toast(window, "Árvore copiada para o clipboard!")
+        txt.pack(fill="both", expand=True)
+        pos = shown = 0
+        loading = False
+
+        def load_page():
+            nonlocal pos, shown, loading
+            loading = False
+            if pos >= len(tree_text) or not txt.winfo_exists():
+                return
+            end, lines = pos, 0
+            while lines < TREE_PAGE_LINES:
+                end = tree_text.find("\n", end) + 1
+                lines += 1
+                if not end:
+                    end = len(tree_text)
+                    break
+            txt.insert("end", tree_text[pos:end])
+            pos, shown = end, shown + lines
+            more = f" — {shown} de {total} linhas" if pos < len(tree_text) else ""
+            tree_win.title(f"Estrutura de Pastas (Copiada pro clipboard){more}")
+
+        def on_scroll(first, last):
+            nonlocal loading
+            vbar.set(first, last)
+            if float(last) > 0.9 and pos < len(tree_text) and not loading:
+                loading = True
+                tree_win.after_idle(load_page)
+
+        txt.config(yscrollcommand=on_scroll, xscrollcommand=hbar.set)
+        load_page()
 
     # -- adiciona o botão junto dos outros em bottom --
     Button(bottom, text="Mapear & Copiar Estrutura", command=map_structure).pack(side=LEFT, padx=5)
+    # opções do mapa: profundidade, agrupar pastas muito cheias, contagem/tamanho por pasta
+    map_box = Frame(right_frame, bg="#f8f8f8")
+    map_box.pack(pady=2, padx=10, fill="x")
+    map_depth_var = tk.StringVar(value=str(TREE_MAX_DEPTH or ""))
+    map_collapse_var = tk.StringVar(value=str(TREE_COLLAPSE or ""))
+    map_sizes_var = tk.IntVar(value=0)
+    tk.Label(map_box, text="Mapa: níveis", bg="#f8f8f8").pack(side=LEFT)
+    tk.Entry(map_box, textvariable=map_depth_var, width=3).pack(side=LEFT, padx=2)
+    tk.Label(map_box, text="agrupar >", bg="#f8f8f8").pack(side=LEFT)
+    tk.Entry(map_box, textvariable=map_collapse_var, width=4).pack(side=LEFT, padx=2)
+    tk.Checkbutton(map_box, text="tamanhos", variable=map_sizes_var, bg="#f8f8f8").pack(side=LEFT)
     Button(right_frame, text="Abrir Nova Pasta", command=open_new_folder).pack(pady=10, padx=10)
     Button(right_frame, text="Remover do Histórico", command=remove_selected_history).pack(pady=2, padx=10)
-    Button(bottom, text="Selecionar Tudo", command=lambda: [var.set(1) for var in vars_dict.values()]).pack(side=LEFT, padx=5)
-    Button(bottom, text="Deselecionar Tudo", command=lambda: [var.set(0) for var in vars_dict.values()]).pack(side=LEFT, padx=5)
+
+    # liga/desliga o cProfile nas próximas ações (varredura, cópia, mapa)
+    profile_var = tk.IntVar(value=1 if metrics.profile_dir else 0)
+
+    def toggle_profile():
+        metrics.profile_dir = (PROFILE_DIR or "profiles") if profile_var.get() else None
+        if profile_var.get():
+            show_toast(window, f"Perfis (.pstats) em: {os.path.abspath(metrics.profile_dir)}")
+
+    tk.Checkbutton(right_frame, text="Perfilar ações (cProfile)", variable=profile_var,
+                   command=toggle_profile, bg="#f8f8f8").pack(pady=2, padx=10)
+
+    # em repositórios git, lista os arquivos pelo git em vez de varrer o disco
+    git_var = tk.IntVar(value=1 if USE_GIT_INDEX else 0)
+
+    def toggle_git():
+        global USE_GIT_INDEX
+        USE_GIT_INDEX = bool(git_var.get())
+        if USE_GIT_INDEX and find_git_dir(current_path) is None:
+            show_toast(window, "Não é um repositório git: a pasta continua sendo varrida.")
+        # revarre mantendo o que está marcado
+        load_selection(current_path, check_tree.selection_to_save() if check_tree else current_saved)
+
+    tk.Checkbutton(right_frame, text="Listar pelo git (repositórios)", variable=git_var,
+                   command=toggle_git, bg="#f8f8f8").pack(pady=2, padx=10)
+    Button(bottom, text="Selecionar Tudo", command=lambda: check_tree and check_tree.select_all()).pack(side=LEFT, padx=5)
+    Button(bottom, text="Deselecionar Tudo", command=lambda: check_tree and check_tree.clear()).pack(side=LEFT, padx=5)
     Button(bottom, text="Copiar", command=on_ok).pack(side=RIGHT, padx=5)
-    Button(bottom, text="Copiar e Fechar", command=lambda: [on_ok(), window.destroy()]).pack(side=RIGHT, padx=5)
+    Button(bottom, text="Copiar Alterações", command=lambda: on_ok(delta=True)).pack(side=RIGHT, padx=5)
+    Button(bottom, text="Copiar e Fechar", command=lambda: on_ok(close=True)).pack(side=RIGHT, padx=5)
+    watch_var = tk.IntVar(value=0)
+    tk.Checkbutton(bottom, text="Observar alterações", variable=watch_var,
+                   command=toggle_watch).pack(side=LEFT, padx=5)
+    status_label = tk.Label(bottom, text="", fg="#555")
+    status_label.pack(side=LEFT, padx=10)
+    # total da seleção estimado pelo stat da varredura (nenhum arquivo é lido)
+    totals_label = tk.Label(bottom, text="", fg="#555")
+    totals_label.pack(side=RIGHT, padx=10)
+
+    def update_totals(*_):
+        if check_tree is None:
+            return
+        files, chars = check_tree.selection_totals()
+        tokens = estimate_tokens(chars)
+        try:
+            budget = parse_budget(budget_var.get())
+        except ValueError:
+            budget = None
+        text = f"{files} arquivos · {format_bytes(chars)} · ~{tokens:,} tokens".replace(",", ".")
+        if budget:
+            text += f" / {budget:,}".replace(",", ".")
+        totals_label.config(text=text, fg="#c00" if budget and tokens > budget else "#555")
+
+    # orçamento do export: divide em partes ou para no primeiro arquivo que não couber
+    budget_box = Frame(right_frame, bg="#f8f8f8")
+    budget_box.pack(pady=2, padx=10, fill="x")
+    tk.Label(budget_box, text="Orçamento (tokens):", bg="#f8f8f8").pack(side=LEFT)
+    budget_var = tk.StringVar()
+    tk.Entry(budget_box, textvariable=budget_var, width=10).pack(side=LEFT, padx=4)
+    budget_var.trace_add("write", update_totals)
+    split_var = tk.IntVar(value=0)
+    tk.Checkbutton(right_frame, text="Dividir em partes (output_001.txt, …)", variable=split_var,
+                   bg="#f8f8f8").pack(pady=2, padx=10)
+    # esboço: classes/funções/assinaturas sem os corpos (botão direito na árvore = por arquivo)
+    outline_var = tk.IntVar(value=0)
+    tk.Checkbutton(right_frame, text="Só assinaturas (esboço)", variable=outline_var,
+                   bg="#f8f8f8").pack(pady=2, padx=10)
+    dedupe_var = tk.IntVar(value=1 if EXPORT_DEDUPE else 0)
+    tk.Checkbutton(right_frame, text="Não repetir arquivos idênticos", variable=dedupe_var,
+                   bg="#f8f8f8").pack(pady=2, padx=10)
+
+
+    def save_session():
+        # snapshot da árvore e da marcação para a próxima abertura começar daqui
+        if check_tree is None or not STARTUP_SNAPSHOT or not SCAN_CACHE_ENABLED:
+            return
+        try:
+            with metrics.span("snapshot", root=check_tree.root_path):
+                save_snapshot(check_tree)
+        except (OSError, sqlite3.Error):
+            pass  # sem snapshot a próxima abertura só varre do zero
+
+    def close_window():
+        stop_watch()
+        save_session()
+        window.destroy()
 
+    window.protocol("WM_DELETE_WINDOW", close_window)
+
+    refresh_metrics()
 
-    
     if history:
         # Seleciona e carrega o primeiro item do histórico
         hist_listbox.selection_clear(0, tk.END)
         hist_listbox.selection_set(0)
         hist_listbox.activate(0)
         entry = history[0]
-        load_selection(entry["path"], entry.get("selected", []))
+        load_selection(entry["path"], store.selection(entry), load_snapshot(entry["path"]))
     else:
-        load_selection(abs_base, saved_selection)
+        load_selection(abs_base, saved_selection, load_snapshot(abs_base))
 
 
-if __name__ == "__main__":
+def find_history_entry(history, name=None, root=None):
+    # procura pelo nome dado no histórico ou pela pasta
+    for entry in history:
+        if name and (entry.get("name") == name or entry.get("path") == name):
+            return entry
+        if root and os.path.normcase(os.path.abspath(entry["path"])) == os.path.normcase(os.path.abspath(root)):
+            return entry
+    return None
+
+def run_export(args):
+    if not args.root and not args.history:
+        print("Informe --root e/ou --history.", file=sys.stderr)
+        return 2
+    store = get_history_store()
+    entry = find_history_entry(store.entries(), args.history, None if args.history else args.root)
+    if args.history and entry is None:
+        print(f"Histórico não encontrado: {args.history}", file=sys.stderr)
+        return 2
+    root = args.root or entry["path"]
+    if not os.path.isdir(root):
+        print(f"Pasta inválida: {root}", file=sys.stderr)
+        return 2
+    if entry is None and not args.all:
+        print("Nenhuma seleção salva para essa pasta (use --history ou --all).", file=sys.stderr)
+        return 2
+    try:
+        args.budget = parse_budget(args.budget)
+    except ValueError:
+        print(f"Orçamento inválido: {args.budget} (ex.: 100000, 100k, 1.5m)", file=sys.stderr)
+        return 2
+    if args.split and (not args.budget or args.out == "-"):
+        print("--split precisa de --budget e de --out ARQUIVO.", file=sys.stderr)
+        return 2
+
+    with metrics.profile("export"):
+        return _run_export(args, store, entry, root)
+
+def _run_export(args, store, entry, root):
+    global BASE_DIR
+    BASE_DIR = os.path.abspath(root)
+    _build_spec()
+    sizes = {}
+    structure = get_directory_structure(root, sizes=sizes)
+    files = list(iter_structure_files(structure))
+    if not args.all:
+        saved = {os.path.normcase(os.path.abspath(p)) for p in store.selection(entry)}
+        files = [p for p in files if os.path.normcase(os.path.abspath(p)) in saved]
+
+    # estimativa só com o stat, antes de ler qualquer arquivo (confere os tamanhos do cache)
+    for _, path, size in restat_sizes(files, sizes):
+        sizes[path] = size
+    chars = sum(estimate_block_size(p, sizes.get(p, 0)) for p in files)
+    estimate = f"{len(files)} arquivos · {format_bytes(chars)} · ~{estimate_tokens(chars)} tokens (estimativa)"
+    if args.estimate:
+        print(estimate)
+        return 0
+    if args.budget or args.stats:
+        print(estimate, file=sys.stderr)
+    budget = args.budget * TOKEN_CHARS if args.budget else None
+
+    if args.split:
+        out = ChunkedOutput(args.out, budget)
+    elif args.out == "-":
+        if hasattr(sys.stdout, "reconfigure"):
+            sys.stdout.reconfigure(encoding="utf-8")
+        out = sys.stdout
+    else:
+        out = open(args.out, "w", encoding="utf-8")
+    try:
+        if args.tree:
+            tree_text = render_tree(structure, root) + "\n\n"
+            out.write(tree_text)
+            if budget is not None and not args.split:
+                budget = max(budget - len(tree_text), 0)
+        previous = None
+        if args.delta:
+            previous = store.last_export(entry) if entry else {}
+        with metrics.span("export", files=len(files), delta=previous is not None):
+            duplicates = duplicate_map(files, sizes) if EXPORT_DEDUPE and not args.no_dedupe else None
+            written, skipped, manifest = stream_export(files, (out,), previous=previous,
+                                                       budget=None if args.split else budget,
+                                                       outline=args.outline or None,
+                                                       duplicates=duplicates)
+    except BrokenPipeError:
+        # stdout fechado antes do fim (ex.: "| head"): sai sem traceback
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if entry is not None:
+        store.save_export(entry, manifest)
+    if args.split:
+        for part in out.parts:
+            print(f"{part['file']}: {part['files']} arquivos, ~{estimate_tokens(part['chars'])} tokens",
+                  file=sys.stderr)
+    for path, reason in skipped:
+        print(f"ignorado: {path} ({reason})", file=sys.stderr)
+    if args.stats:
+        print(metrics.summary(), file=sys.stderr)
+    return 0
+
+def run_tree(args):
+    # mapa da pasta direto num arquivo ou no stdout, linha a linha
+    store = get_history_store()
+    entry = find_history_entry(store.entries(), args.history, None) if args.history else None
+    if args.history and entry is None:
+        print(f"Histórico não encontrado: {args.history}", file=sys.stderr)
+        return 2
+    root = args.root or (entry["path"] if entry else None)
+    if not root or not os.path.isdir(root):
+        print(f"Pasta inválida: {root}" if root else "Informe --root ou --history.", file=sys.stderr)
+        return 2
+    global BASE_DIR
+    BASE_DIR = os.path.abspath(root)
+    _build_spec()
+    sizes = {}
+    structure = get_directory_structure(root, sizes=sizes)
+    totals = tree_totals(structure, root, sizes) if args.sizes else None
+
+    if args.out == "-":
+        if hasattr(sys.stdout, "reconfigure"):
+            sys.stdout.reconfigure(encoding="utf-8")
+        out = sys.stdout
+    else:
+        out = open(args.out, "w", encoding="utf-8")
+    try:
+        with metrics.span("map_structure", root=root):
+            write_tree(out, structure, root, max_depth=args.max_depth, collapse=args.collapse,
+                       totals=totals, sizes=args.sizes)
+            out.write("\n")
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="index.py", description="Mapeador de estruturas: sem argumentos abre a interface gráfica.")
+    parser.add_argument("--trace", metavar="ARQUIVO", default=TRACE_FILE,
+                        help="grava cada etapa cronometrada em JSON-lines (ou MAPEADOR_TRACE)")
+    parser.add_argument("--profile", metavar="PASTA", default=PROFILE_DIR,
+                        help="roda as ações sob cProfile e salva os .pstats aqui (ou MAPEADOR_PROFILE)")
+    parser.add_argument("--scan-workers", type=int, metavar="N",
+                        help="threads da varredura (1 = sequencial; padrão: paralelo só em pasta de rede)")
+    parser.add_argument("--git", action="store_true",
+                        help="em repositórios, lista os arquivos pelo git (rastreados + não ignorados)")
+    sub = parser.add_subparsers(dest="command")
+    export = sub.add_parser("export", help="exporta os arquivos selecionados sem abrir a interface")
+    export.add_argument("--root", help="pasta a mapear (padrão: a do histórico)")
+    export.add_argument("--history", help="nome (ou pasta) da entrada do histórico com a seleção")
+    export.add_argument("--all", action="store_true", help="exporta todos os arquivos não ignorados")
+    export.add_argument("--out", default="-", help="arquivo de saída ('-' = stdout)")
+    export.add_argument("--tree", action="store_true", help="inclui a árvore de pastas antes dos arquivos")
+    export.add_argument("--delta", action="store_true",
+                        help="só os arquivos alterados/novos/removidos desde o último export da entrada")
+    export.add_argument("--stats", action="store_true", help="mostra os tempos e contadores no stderr")
+    export.add_argument("--budget", metavar="TOKENS",
+                        help="orçamento do export em tokens (ex.: 100k); sem --split, para no primeiro "
+                             "arquivo que não couber e lista os que ficaram de fora")
+    export.add_argument("--split", action="store_true",
+                        help="com --budget, divide em partes numeradas (saida_001.txt, ...) entre arquivos")
+    export.add_argument("--outline", action="store_true",
+                        help="código (Python, JS/TS, PHP...) sai só com classes, funções e assinaturas")
+    export.add_argument("--no-dedupe", action="store_true",
+                        help="repete o conteúdo de arquivos idênticos (padrão: só uma referência ao primeiro)")
+    export.add_argument("--estimate", action="store_true",
+                        help="só mostra arquivos/bytes/tokens estimados pelo stat, sem ler nada")
+    export.set_defaults(func=run_export)
+    tree = sub.add_parser("tree", help="escreve o mapa de pastas (como o botão \"Mapear\") sem abrir a interface")
+    tree.add_argument("--root", help="pasta a mapear (padrão: a do histórico)")
+    tree.add_argument("--history", help="nome (ou pasta) da entrada do histórico")
+    tree.add_argument("--out", default="-", help="arquivo de saída ('-' = stdout)")
+    tree.add_argument("--max-depth", type=int, metavar="N", default=TREE_MAX_DEPTH,
+                      help="mostra só N níveis (o resto vira '… (N itens)')")
+    tree.add_argument("--collapse", type=int, metavar="N", default=TREE_COLLAPSE,
+                      help="pastas com mais de N filhos viram '… (N arquivos)'")
+    tree.add_argument("--sizes", action="store_true", help="nº de arquivos e tamanho total em cada pasta")
+    tree.set_defaults(func=run_tree)
+    return parser
+
+def run_gui():
+    from tkinter import Tk, filedialog
     root = Tk()
-    history = load_history()
+    store = get_history_store()
+    history = store.entries()
     if history:
         last = history[0]
         initial_path = last["path"]
-        sel = last.get("selected", [])
+        sel = store.selection(last)
         root.deiconify()
         show_selection_gui(root, initial_path, sel)
         root.mainloop()
@@ -547,9 +3851,30 @@ if __name__ == "__main__":
             print("Nenhuma pasta foi selecionada.")
         else:
             sel = []
-            history = add_or_update_history(load_history(), initial_path, sel)
-            save_history(history)
+            store.save_selection(initial_path, sel)
             root.deiconify()
             show_selection_gui(root, initial_path, sel)
             root.mainloop()
 
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    metrics.trace_file = args.trace
+    metrics.profile_dir = args.profile
+    global SCAN_WORKERS, USE_GIT_INDEX
+    if args.scan_workers is not None:
+        SCAN_WORKERS = args.scan_workers
+    if args.git:
+        USE_GIT_INDEX = True
+    try:
+        if args.command is None:
+            run_gui()
+            return 0
+        return args.func(args)
+    finally:
+        metrics.close()
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # pool do esboço no executável do pyinstaller
+    sys.exit(main())